@@ -1,63 +1,103 @@
 import os
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, make_response, session, redirect, url_for, flash
 from flask_login import LoginManager, current_user, login_user, logout_user, login_required
 from flask_wtf.csrf import CSRFProtect
-from flask_caching import Cache
 from mongoengine import connect
 from werkzeug.security import generate_password_hash
-from werkzeug.utils import secure_filename
-import uuid
 from datetime import datetime
 import json
-    # Register blueprints
-from routes.index import index_bp
-from routes.auth import auth_bp
-from routes.study_creation import study_creation_bp
-from routes.study_participation import study_participation
-from routes.dashboard import dashboard_bp
-from routes.api import api_bp
-    
+import importlib
 
 # Import configuration
 from config import config
+from utils.cache import cache
+
+# Blueprints, models and forms are imported lazily (inside create_app or the
+# functions that need them) so a worker only pays their import cost once it
+# actually builds the app. These names used to be module-level imports; keep
+# `from app import User` and friends working through __getattr__ below.
+_LAZY_IMPORTS = {
+    'index_bp': 'routes.index',
+    'auth_bp': 'routes.auth',
+    'study_creation_bp': 'routes.study_creation',
+    'study_participation': 'routes.study_participation',
+    'dashboard_bp': 'routes.dashboard',
+    'api_bp': 'routes.api',
+    'User': 'models.user',
+    'Study': 'models.study',
+    'RatingScale': 'models.study',
+    'StudyElement': 'models.study',
+    'ClassificationQuestion': 'models.study',
+    'IPEDParameters': 'models.study',
+    'StudyDraft': 'models.study_draft',
+    'StudyResponse': 'models.response',
+    'TaskSession': 'models.response',
+    'LoginForm': 'forms.auth',
+    'RegistrationForm': 'forms.auth',
+    'PasswordResetRequestForm': 'forms.auth',
+    'PasswordResetForm': 'forms.auth',
+    'ProfileUpdateForm': 'forms.auth',
+    'Step1aBasicDetailsForm': 'forms.study',
+    'Step1bStudyTypeForm': 'forms.study',
+    'Step1cRatingScaleForm': 'forms.study',
+    'Step2cIPEDParametersForm': 'forms.study',
+    'Step3aTaskGenerationForm': 'forms.study',
+    'Step3bLaunchForm': 'forms.study',
+}
 
-# Import models
-from models.user import User
-from models.study import Study, RatingScale, StudyElement, ClassificationQuestion, IPEDParameters
-from models.study_draft import StudyDraft
-from models.response import StudyResponse, TaskSession
+def __getattr__(name):
+    """Resolve the lazily imported blueprints, models and forms on first access."""
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module_name), name)
 
-# Import forms
-from forms.auth import LoginForm, RegistrationForm, PasswordResetRequestForm, PasswordResetForm, ProfileUpdateForm
-from forms.study import (
-    Step1aBasicDetailsForm, Step1bStudyTypeForm, Step1cRatingScaleForm,
-    Step2cIPEDParametersForm, Step3aTaskGenerationForm, Step3bLaunchForm
-)
+def _format_duration(seconds):
+    """Format a duration in seconds as s/m/h."""
+    if seconds < 60:
+        return "%.1fs" % seconds
+    elif seconds < 3600:
+        return "%.1fm" % (seconds / 60)
+    else:
+        return "%.1fh" % (seconds / 3600)
 
 # Initialize extensions
 login_manager = LoginManager()
 csrf = CSRFProtect()
-cache = Cache()
 
 def create_app(config_name='default'):
     """Application factory function."""
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    # Serialize JSON responses (jsonify, tojson) with orjson
+    from utils.json_provider import OrjsonProvider
+    app.json = OrjsonProvider(app)
+    
+    # Configure logging once at startup; debug messages built with %-style
+    # arguments cost nothing unless LOG_LEVEL enables them.
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    
     # Ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
+    # Normalised allowed-extension set, computed once for upload checks
+    app.config['_ALLOWED_EXT_SET'] = frozenset(
+        ext.lower().lstrip('.') for ext in app.config['ALLOWED_EXTENSIONS']
+    )
+    
     # Initialize extensions
     # Connect to MongoDB with highly optimized settings for performance
     connect(
         host=app.config['MONGODB_SETTINGS']['host'],
-        maxPoolSize=50,  # Increased for better concurrency
-        minPoolSize=5,   # Increased minimum connections
-        maxIdleTimeMS=60000,  # Keep connections alive longer
+        appname='inniImage',  # Identifies this app's pools in MongoDB logs
+        connect=False,   # Don't dial or start monitors until the first query
+        maxPoolSize=50,  # Per worker; the driver grows the pool on demand
+        minPoolSize=0,   # Idle workers don't hold sockets open
+        maxIdleTimeMS=300000,  # Close connections idle for 5 minutes
         serverSelectionTimeoutMS=2000,  # Faster server selection
         connectTimeoutMS=2000,  # Faster connection
         socketTimeoutMS=10000,  # Reasonable socket timeout
-        waitQueueTimeoutMS=2000,  # Faster queue timeout
         maxConnecting=10,  # Limit concurrent connections
         retryWrites=True,  # Enable retry for writes
         retryReads=True,   # Enable retry for reads
@@ -71,6 +111,9 @@ def create_app(config_name='default'):
     # Initialize CSRF protection
     csrf.init_app(app)
     
+    # Application cache (Redis when REDIS_URL is set, in-process otherwise)
+    cache.init_app(app)
+    
 
     
     # Configure session management for persistence
@@ -79,6 +122,25 @@ def create_app(config_name='default'):
     app.config['SESSION_COOKIE_HTTPONLY'] = True
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
     
+    # Store sessions server-side in Redis so the cookie only carries the
+    # session id; without REDIS_URL keep Flask's signed-cookie sessions.
+    if app.config.get('REDIS_URL'):
+        from utils.cache import get_redis
+        from utils.session_interface import TransientRedisSessionInterface
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = get_redis(app.config['REDIS_URL'])
+        app.session_interface = TransientRedisSessionInterface(
+            app.config['SESSION_REDIS'], app.config['SESSION_KEY_PREFIX'],
+            app.config['SESSION_USE_SIGNER'], app.config['SESSION_PERMANENT']
+        )
+    
+    # Register blueprints
+    from routes.index import index_bp
+    from routes.auth import auth_bp
+    from routes.study_creation import study_creation_bp
+    from routes.study_participation import study_participation
+    from routes.dashboard import dashboard_bp
+    from routes.api import api_bp
 
     app.register_blueprint(index_bp)
     app.register_blueprint(auth_bp)
@@ -92,8 +154,9 @@ def create_app(config_name='default'):
     # User loader for Flask-Login
     @login_manager.user_loader
     def load_user(user_id):
+        from models.user import load_cached_user
         try:
-            return User.objects(_id=user_id).first()
+            return load_cached_user(user_id)
         except:
             return None
     
@@ -102,14 +165,31 @@ def create_app(config_name='default'):
     def health_check():
         """Health check endpoint for monitoring."""
         try:
-            # Simple connection check - much faster
+            # Readiness probe: the first real round-trip to MongoDB happens
+            # here rather than at worker startup
             from mongoengine import get_db
             db = get_db()
-            # Use a lightweight command instead of ping
-            db.command('ismaster', maxTimeMS=1000)
-            return jsonify({'status': 'healthy', 'database': 'connected'}), 200
+            db.command('ping', maxTimeMS=1000)
+            response = jsonify({'status': 'healthy', 'database': 'connected'})
+            status = 200
         except Exception as e:
-            return jsonify({'status': 'unhealthy', 'database': str(e)}), 500
+            response = jsonify({'status': 'unhealthy', 'database': str(e)})
+            status = 500
+        # Liveness must always be fresh; never let a proxy answer for us
+        response.headers['Cache-Control'] = 'no-store'
+        return response, status
+    
+    # Well-known paths probed by browsers, bots and devtools. Answer with an
+    # empty, long-cacheable 204 instead of rendering the 404 page each time.
+    def empty_cacheable_response():
+        response = make_response('', 204)
+        response.headers['Cache-Control'] = 'public, max-age=86400'
+        return response
+    
+    app.add_url_rule('/favicon.ico', 'favicon', empty_cacheable_response)
+    app.add_url_rule('/robots.txt', 'robots_txt', empty_cacheable_response)
+    app.add_url_rule('/.well-known/appspecific/com.chrome.devtools.json',
+                     'chrome_devtools_json', empty_cacheable_response)
     
     # Error handlers
     @app.errorhandler(404)
@@ -138,22 +218,13 @@ def create_app(config_name='default'):
         """Contact page."""
         return render_template('contact.html')
     
-    # File upload helper
-    def allowed_file(filename):
-        """Check if file extension is allowed."""
-        return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
-    
-    def save_uploaded_file(file, study_id):
-        """Save uploaded file and return file path."""
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Create unique filename
-            unique_filename = f"{study_id}_{uuid.uuid4().hex}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
-            return unique_filename
-        return None
+    
+    # One-shot index management: run `flask ensure-indexes` once per deploy
+    # instead of building indexes in every worker
+    @app.cli.command('ensure-indexes')
+    def ensure_indexes_command():
+        """Create MongoDB indexes for all models."""
+        ensure_indexes(app)
     
     # Register template filters
     @app.template_filter('format_datetime')
@@ -166,25 +237,23 @@ def create_app(config_name='default'):
     def format_duration_filter(seconds):
         if seconds is None:
             return "0s"
-        if seconds < 60:
-            return f"{seconds:.1f}s"
-        elif seconds < 3600:
-            minutes = seconds / 60
-            return f"{minutes:.1f}m"
-        else:
-            hours = seconds / 3600
-            return f"{hours:.1f}h"
+        return _format_duration(seconds)
     
     return app
 
-def create_tables():
-    """Create database tables/indexes with performance optimization."""
-    app = create_app()
+def ensure_indexes(app):
+    """Create database indexes with performance optimization."""
+    from models.user import User
+    from models.study import Study, RespondentTaskPlan
+    from models.study_draft import StudyDraft
+    from models.response import StudyResponse, TaskSession
+
     with app.app_context():
         try:
             # Create basic indexes
             User.ensure_indexes()
             Study.ensure_indexes()
+            RespondentTaskPlan.ensure_indexes()
             StudyDraft.ensure_indexes()
             StudyResponse.ensure_indexes()
             TaskSession.ensure_indexes()
@@ -195,13 +264,14 @@ def create_tables():
             
             # Study indexes for dashboard queries
             db.studies.create_index([('creator', 1), ('status', 1), ('created_at', -1)], background=True)
-            db.studies.create_index([('share_token', 1)], background=True)
             db.studies.create_index([('status', 1), ('created_at', -1)], background=True)
             
             # StudyResponse indexes for analytics
             db.study_responses.create_index([('study', 1), ('created_at', -1)], background=True)
             db.study_responses.create_index([('study', 1), ('is_completed', 1)], background=True)
             db.study_responses.create_index([('study', 1), ('is_abandoned', 1)], background=True)
+            db.study_responses.create_index([('study', 1), ('session_start_time', -1)], background=True)
+            db.study_responses.create_index([('study', 1), ('last_activity', -1)], background=True)
             db.study_responses.create_index([('session_id', 1)], background=True)
             db.study_responses.create_index([('last_activity', -1)], background=True)
             
@@ -209,12 +279,15 @@ def create_tables():
             db.users.create_index([('username', 1)], background=True)
             db.users.create_index([('email', 1)], background=True)
             
-            print("Database indexes created successfully with performance optimization!")
+            app.logger.info("Database indexes created successfully with performance optimization!")
             
         except Exception as e:
-            print(f"Error creating indexes: {e}")
             # Continue with basic indexes if advanced ones fail
-            print("Continuing with basic indexes...")
+            app.logger.warning("Error creating indexes: %s; continuing with basic indexes", e)
+
+def create_tables():
+    """Create database tables/indexes (prefer `flask ensure-indexes` in deployments)."""
+    ensure_indexes(create_app())
 
 if __name__ == '__main__':
     app = create_app()
@@ -23,6 +23,33 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     WTF_CSRF_TIME_LIMIT = 3600  # 1 hour CSRF token expiry
+    
+    # Logging
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    
+    # Debug-only routes (e.g. /study/create/debug-draft) are also registered when DEBUG is on
+    ENABLE_DEBUG_ROUTES = os.environ.get('ENABLE_DEBUG_ROUTES', '').lower() in ('1', 'true', 'yes')
+    
+    # Redis (server-side sessions). Sessions fall back to signed cookies when unset.
+    REDIS_URL = os.environ.get('REDIS_URL')
+    # Only logins mark their session permanent; participant sessions end with
+    # the browser and are evicted from Redis after TRANSIENT_SESSION_LIFETIME
+    SESSION_PERMANENT = False
+    TRANSIENT_SESSION_LIFETIME = timedelta(hours=2)
+    # Only write sessions back when they change
+    SESSION_REFRESH_EACH_REQUEST = False
+    SESSION_USE_SIGNER = True
+    SESSION_KEY_PREFIX = 'session:'
+    
+    # Flask-Caching: shared Redis cache when available, per-process otherwise
+    CACHE_TYPE = 'RedisCache' if REDIS_URL else 'SimpleCache'
+    CACHE_REDIS_URL = REDIS_URL
+    CACHE_KEY_PREFIX = 'cache:'
+    CACHE_DEFAULT_TIMEOUT = 60
+
+    # Threads per worker process for background jobs (task matrix generation,
+    # element image uploads)
+    BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS') or 4)
 
 class DevelopmentConfig(Config):
     """Development configuration."""
@@ -78,6 +78,8 @@ class StudyResponse(Document):
     
     meta = {
         'collection': 'study_responses',
+        # Indexes are built by `flask ensure-indexes`, not by each worker on first use
+        'auto_create_index': False,
         'indexes': [
             'study',
             'session_id',
@@ -88,12 +90,19 @@ class StudyResponse(Document):
         ]
     }
     
+    @staticmethod
+    def compute_completion_percentage(completed_tasks_count, total_tasks_assigned):
+        """Return the completion percentage for a task count, capped at 100."""
+        if not total_tasks_assigned:
+            return 0.0
+        # Capped since a resubmitted task can push the count past the number assigned
+        return min(100.0, 100.0 * completed_tasks_count / total_tasks_assigned)
+    
     def update_completion_percentage(self):
         """Update completion percentage based on completed tasks."""
-        if self.total_tasks_assigned > 0:
-            self.completion_percentage = (self.completed_tasks_count / self.total_tasks_assigned) * 100.0
-        else:
-            self.completion_percentage = 0.0
+        self.completion_percentage = self.compute_completion_percentage(
+            self.completed_tasks_count, self.total_tasks_assigned
+        )
     
     def add_completed_task(self, task_data):
         """Add a completed task to the response."""
@@ -188,6 +197,7 @@ class TaskSession(Document):
     
     meta = {
         'collection': 'task_sessions',
+        'auto_create_index': False,
         'indexes': [
             'session_id',
             'task_id',
@@ -2,8 +2,30 @@ from random import choice
 from mongoengine import Document, StringField, ReferenceField, DateTimeField, BooleanField, IntField, ListField, DictField, EmbeddedDocument, EmbeddedDocumentField, URLField
 from datetime import datetime
 import numpy as np
+import math
 import json
 import uuid
+from threading import Lock
+from cachetools import TTLCache
+from utils.cache import cache
+
+# Participation pages read studies through get_cached_study; writes must go
+# through the database and then call invalidate_study.
+STUDY_CACHE_TIMEOUT = 60
+# Fields the participation pages read from a study
+PARTICIPATION_FIELDS = ('title', 'status', 'study_type', 'main_question', 'rating_scale',
+                        'classification_questions', 'iped_parameters', 'share_token')
+# Generated tasks don't change while a study is live
+TASK_CACHE_TIMEOUT = 3600
+# Share tokens never change once a study is created
+SHARE_TOKEN_CACHE_TIMEOUT = 24 * 3600
+
+# Per-process cache in front of the shared one, so repeated hits on a worker
+# skip fetching and unpickling the study. Entries are tagged with the study's
+# shared version counter, which invalidate_study bumps, so every worker drops
+# its copy as soon as the study changes.
+_local_study_cache = TTLCache(maxsize=1024, ttl=30)
+_local_study_cache_lock = Lock()
 
 class RatingScale(EmbeddedDocument):
     """Embedded document for rating scale configuration."""
@@ -48,6 +70,56 @@ class IPEDParameters(EmbeddedDocument):
     max_active_elements = IntField(required=True, min_value=1, max_value=20)
     total_tasks = IntField(required=True)  # Calculated: tasks_per_consumer * number_of_respondents
 
+def generate_task_design(num_elements, num_tasks, min_active, max_active, rng=None):
+    """Return a (num_tasks, num_elements) 0/1 uint8 matrix of IPED tasks.
+    
+    Each task is drawn uniformly from all element combinations with between
+    min_active and max_active elements shown, sampled in bulk rather than by
+    rejection.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    sizes = np.arange(min_active, min(max_active, num_elements) + 1)
+    if not sizes.size:
+        raise ValueError('min_active_elements must not exceed max_active_elements or num_elements')
+    
+    # Number of active elements per task, weighted by how many combinations have that size
+    weights = np.array([math.comb(num_elements, k) for k in sizes], dtype=float)
+    active_counts = rng.choice(sizes, size=num_tasks, p=weights / weights.sum())
+    
+    # Rank random keys within each task; the active_counts lowest ranks are shown
+    ranks = rng.random((num_tasks, num_elements)).argsort(axis=1).argsort(axis=1)
+    return (ranks < active_counts[:, None]).astype(np.uint8)
+
+def build_task_matrix(design, contents):
+    """Convert a (respondents, tasks, elements) design into the Study.tasks structure.
+    
+    contents holds each element's content (image URL), in element order.
+    """
+    num_elements = design.shape[2]
+    element_names = [f"E{i+1}" for i in range(num_elements)]
+    content_keys = [f"{name}_content" for name in element_names]
+    contents = list(contents[:num_elements]) + [""] * (num_elements - len(contents))
+    
+    # One list of tasks per respondent; element content is only shown if the
+    # element itself is shown
+    tasks_structure = {}
+    for respondent_id, respondent_task_data in enumerate(design.tolist()):
+        respondent_tasks = []
+        for task_index, task_data in enumerate(respondent_task_data):
+            elements_shown = {}
+            for element_name, content_key, content, element_active in zip(element_names, content_keys, contents, task_data):
+                elements_shown[element_name] = element_active
+                elements_shown[content_key] = content if element_active else ""
+            
+            respondent_tasks.append({
+                "task_id": f"{respondent_id}_{task_index}",
+                "elements_shown": elements_shown,
+                "task_index": task_index
+            })
+        
+        tasks_structure[str(respondent_id)] = respondent_tasks
+    return tasks_structure
+
 class Study(Document):
     """Study model with complete IPED configuration and task matrix."""
     
@@ -95,10 +167,11 @@ class Study(Document):
     
     meta = {
         'collection': 'studies',
+        # Indexes are built by `flask ensure-indexes`, not by each worker on first use
+        'auto_create_index': False,
         'indexes': [
             'creator',
             'status',
-            'share_token',
             'created_at',
             'study_type'
         ]
@@ -114,68 +187,15 @@ class Study(Document):
         num_elements = self.iped_parameters.num_elements
         tasks_per_consumer = self.iped_parameters.tasks_per_consumer
         num_consumers = self.iped_parameters.number_of_respondents
-        min_active = self.iped_parameters.min_active_elements
-        max_active = self.iped_parameters.max_active_elements
-        
-        total_tasks = tasks_per_consumer * num_consumers
         
-        # Generate candidate pool
-        candidate_pool = []
-        num_candidates_to_generate = total_tasks * 20  # Increased for better variety
-        
-        while len(candidate_pool) < num_candidates_to_generate:
-            random_task = np.random.randint(0, 2, num_elements)
-            if min_active <= sum(random_task) <= max_active:
-                candidate_pool.append(random_task)
-        
-        if len(candidate_pool) < total_tasks:
-            final_tasks = candidate_pool
-        else:
-            # Select tasks ensuring better distribution
-            final_tasks = np.array(candidate_pool)[np.random.choice(len(candidate_pool), total_tasks, replace=False)]
-        
-        # Convert to the required structure with balanced distribution per respondent
-        tasks_structure = {}
-        element_names = [f"E{i+1}" for i in range(num_elements)]
-        
-        # Shuffle tasks to ensure random distribution per respondent
-        np.random.shuffle(final_tasks)
-        
-        for respondent_id in range(num_consumers):
-            respondent_tasks = []
-            start_idx = respondent_id * tasks_per_consumer
-            end_idx = start_idx + tasks_per_consumer
-            
-            # Get tasks for this specific respondent
-            respondent_task_data = final_tasks[start_idx:end_idx]
-            
-            for task_index, task_data in enumerate(respondent_task_data):
-                # Create elements_shown dictionary
-                elements_shown = {}
-                for i, element_name in enumerate(element_names):
-                    # Element is only shown if it's active in this task
-                    element_active = int(task_data[i])
-                    elements_shown[element_name] = element_active
-                    
-                    # Element content is only shown if the element itself is shown
-                    if element_active and self.elements and i < len(self.elements):
-                        print(f"DEBUG: Element {i}: {self.elements[i]}")
-                        print(f"DEBUG: Element content: {getattr(self.elements[i], 'content', 'NO_CONTENT_ATTR')}")
-                        elements_shown[f"{element_name}_content"] = getattr(self.elements[i], 'content', '')
-                    else:
-                        print(f"DEBUG: Element {i} not active or no content available")
-                        elements_shown[f"{element_name}_content"] = ""
-
-                
-                task_obj = {
-                    "task_id": f"{respondent_id}_{task_index}",
-                    "elements_shown": elements_shown,
-                    "task_index": task_index
-                }
-                respondent_tasks.append(task_obj)
-            
-            tasks_structure[str(respondent_id)] = respondent_tasks
+        design = generate_task_design(
+            num_elements,
+            tasks_per_consumer * num_consumers,
+            self.iped_parameters.min_active_elements,
+            self.iped_parameters.max_active_elements
+        ).reshape(num_consumers, tasks_per_consumer, num_elements)
         
+        tasks_structure = build_task_matrix(design, [getattr(element, 'content', '') for element in self.elements or []])
         self.tasks = tasks_structure
         return tasks_structure
     
@@ -237,3 +257,139 @@ class Study(Document):
     
     def __repr__(self):
         return f'<Study {self.title}>'
+
+class RespondentTaskPlan(Document):
+    """One respondent's task, copied out of Study.tasks so it can be fetched on its own."""
+    
+    study_id = StringField(required=True)
+    respondent_id = IntField(required=True, min_value=0)
+    task_index = IntField(required=True, min_value=0)
+    task_id = StringField(required=True)
+    elements_shown = DictField(required=True)
+    
+    meta = {
+        'collection': 'respondent_task_plans',
+        'auto_create_index': False,
+        'indexes': [
+            {'fields': ['study_id', 'respondent_id', 'task_index'], 'unique': True}
+        ]
+    }
+    
+    def to_task(self):
+        """Return the task in the Study.tasks entry format."""
+        return {
+            'task_id': self.task_id,
+            'elements_shown': self.elements_shown,
+            'task_index': self.task_index
+        }
+
+def save_task_plans(study_id):
+    """Replace a study's RespondentTaskPlan documents with its current task matrix."""
+    study = Study.objects(_id=study_id).only('tasks').first()
+    RespondentTaskPlan.objects(study_id=study_id).delete()
+    if study is None or not study.tasks:
+        return
+    plans = [
+        RespondentTaskPlan(
+            study_id=study_id,
+            respondent_id=int(respondent_id),
+            task_index=task['task_index'],
+            task_id=task['task_id'],
+            elements_shown=task['elements_shown']
+        )
+        for respondent_id, tasks in study.tasks.items()
+        for task in tasks
+    ]
+    if plans:
+        RespondentTaskPlan.objects.insert(plans, load_bulk=False)
+        # Drop tasks cached from the previous matrix
+        cache.delete_many(*[_task_cache_key(study_id, plan.respondent_id, plan.task_index) for plan in plans])
+
+def _task_cache_key(study_id, respondent_id, task_index):
+    return f'task:{study_id}:{respondent_id}:{task_index}'
+
+def load_respondent_task(study_id, respondent_id, task_index):
+    """Fetch a single task of a respondent's plan, or None if it doesn't exist.
+    
+    Tasks are cached; the matrix can only be regenerated while a study isn't
+    active, and save_task_plans drops the cached entries when it does.
+    """
+    key = _task_cache_key(study_id, respondent_id, task_index)
+    task = cache.get(key)
+    if task is not None:
+        return task
+    
+    plan = RespondentTaskPlan.objects(
+        study_id=study_id, respondent_id=respondent_id, task_index=task_index
+    ).only('task_id', 'elements_shown', 'task_index').first()
+    if plan is not None:
+        task = plan.to_task()
+    else:
+        # Studies whose plans haven't been written (yet) fall back to the
+        # matrix, slicing out just this task
+        path = f'tasks.{respondent_id}'
+        doc = Study._get_collection().find_one(
+            {'_id': study_id}, {'_id': 1, path: {'$slice': [task_index, 1]}}
+        )
+        respondent_tasks = (doc or {}).get('tasks', {}).get(str(respondent_id), [])
+        if task_index < 0 or not respondent_tasks:
+            return None
+        task = respondent_tasks[0]
+    
+    cache.set(key, task, timeout=TASK_CACHE_TIMEOUT)
+    return task
+
+def _study_cache_key(study_id):
+    return f'study:{study_id}'
+
+def classification_html_cache_key(study_id):
+    """Cache key of a study's rendered classification questions (dropped by invalidate_study)."""
+    return f'cq_html:{study_id}'
+
+def _study_version_key(study_id):
+    return f'study_version:{study_id}'
+
+def get_cached_study(study_id):
+    """Return the participation fields of a Study (PARTICIPATION_FIELDS), served from cache when possible.
+    
+    Raises Study.DoesNotExist like Study.objects.get(). The result is a
+    snapshot: don't save it, update the database and call invalidate_study.
+    """
+    key = _study_cache_key(study_id)
+    version = cache.get(_study_version_key(study_id)) or 0
+    with _local_study_cache_lock:
+        entry = _local_study_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    
+    study = cache.get(key)
+    if study is None:
+        # Leaves out the task matrix (use load_respondent_task), the element
+        # images and the long orientation/background texts
+        study = Study.objects.only(*PARTICIPATION_FIELDS).get(_id=study_id)
+        cache.set(key, study, timeout=STUDY_CACHE_TIMEOUT)
+    with _local_study_cache_lock:
+        _local_study_cache[key] = (version, study)
+    return study
+
+def get_study_status(study_id):
+    """Return a study's status from the study cache; raises Study.DoesNotExist."""
+    return get_cached_study(study_id).status
+
+def get_cached_study_by_token(share_token):
+    """Like get_cached_study, but looks the study up by its share token."""
+    key = f'study_token:{share_token}'
+    study_id = cache.get(key)
+    if study_id is None:
+        study_id = Study.objects.only('_id').get(share_token=share_token)._id
+        cache.set(key, study_id, timeout=SHARE_TOKEN_CACHE_TIMEOUT)
+    return get_cached_study(study_id)
+
+def invalidate_study(study_id):
+    """Drop a cached study so the next read reloads it from MongoDB."""
+    key = _study_cache_key(study_id)
+    with _local_study_cache_lock:
+        _local_study_cache.pop(key, None)
+    cache.delete_many(key, classification_html_cache_key(study_id))
+    # Other workers compare their local copies against this counter
+    cache.inc(_study_version_key(study_id))
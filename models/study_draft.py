@@ -1,7 +1,34 @@
-from mongoengine import Document, StringField, DictField, DateTimeField, ReferenceField, UUIDField, BooleanField
+from mongoengine import Document, StringField, DictField, DateTimeField, ReferenceField, UUIDField, BooleanField, IntField, BinaryField
 from datetime import datetime
+import numpy as np
 import uuid
 
+# One bit per creation step in StudyDraft.completion_mask
+STEP_BITS = {
+    step: 1 << i
+    for i, step in enumerate(('1a', '1b', '1c', '1c_layer', '2a', '2a_layer', '2b', '2c', '3a', '3b'))
+}
+
+GRID_STEP_ORDER = ('1a', '1b', '1c', '2a', '2b', '2c', '3a', '3b')
+LAYER_STEP_ORDER = ('1a', '1b', '1c', '1c_layer', '2a_layer', '2b', '2c', '3a', '3b')
+
+def _steps_mask(*steps):
+    mask = 0
+    for step in steps:
+        mask |= STEP_BITS[step]
+    return mask
+
+# For can_access_step: (steps that must all be complete, steps of which one must be complete)
+_ACCESS_REQUIREMENTS = {
+    '1b': (_steps_mask('1a'), 0),
+    '1c': (_steps_mask('1a', '1b'), 0),
+    '1c_layer': (_steps_mask('1a', '1b', '1c'), 0),
+    '2a': (_steps_mask('1a', '1b', '1c'), 0),
+    '2a_layer': (_steps_mask('1a', '1b', '1c', '1c_layer'), 0),
+}
+# Steps 2b and beyond need the common steps plus either elements step
+_LATER_STEP_REQUIREMENTS = (_steps_mask('1a', '1b', '1c'), _steps_mask('2a', '2a_layer'))
+
 class StudyDraft(Document):
     """Model for storing study creation drafts in the database."""
     
@@ -21,6 +48,13 @@ class StudyDraft(Document):
     step3a_data = DictField(default={})
     step3b_data = DictField(default={})
     
+    # Generated task design as packed bits; its shape is kept in step3a_data
+    step3a_blob = BinaryField()
+    
+    # Bitmask of completed steps (see STEP_BITS). None for drafts saved before
+    # the mask existed; it is then derived from the step data on first use.
+    completion_mask = IntField()
+    
     # Metadata
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
@@ -28,10 +62,14 @@ class StudyDraft(Document):
     
     meta = {
         'collection': 'study_drafts',
+        # Indexes are built by `flask ensure-indexes`, not by each worker on first use
+        'auto_create_index': False,
         'indexes': [
             'user',
             'created_at',
-            ('user', 'created_at')
+            ('user', 'created_at'),
+            # get_study_draft: user's newest incomplete draft in one index seek
+            ('user', 'is_complete', '-created_at')
         ]
     }
     
@@ -39,19 +77,48 @@ class StudyDraft(Document):
         """Update data for a specific step."""
         step_field = f'step{step}_data'
         if hasattr(self, step_field):
+            self.completion_mask = self._mask_with_step(step, data)
             setattr(self, step_field, data)
             self.updated_at = datetime.utcnow()
             self.save()
     
+    def update_step_and_advance(self, step, data, next_step, **fields):
+        """Store a step's data (plus any extra fields) and move to next_step in a single atomic update."""
+        step_field = f'step{step}_data'
+        completion_mask = self._mask_with_step(step, data)
+        now = datetime.utcnow()
+        StudyDraft.objects(pk=self.pk).update_one(**{
+            f'set__{step_field}': data,
+            'set__current_step': next_step,
+            'set__completion_mask': completion_mask,
+            'set__updated_at': now
+        }, **{f'set__{name}': value for name, value in fields.items()})
+        
+        # Mirror the write locally without leaving the fields marked as changed
+        setattr(self, step_field, data)
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.current_step = next_step
+        self.completion_mask = completion_mask
+        self.updated_at = now
+        self._clear_changed_fields()
+    
     def get_step_data(self, step):
         """Get data for a specific step."""
         step_field = f'step{step}_data'
         return getattr(self, step_field, {})
     
-    def is_step_complete(self, step):
-        """Check if a specific step is complete."""
-        step_data = self.get_step_data(step)
-        
+    def get_task_design(self):
+        """Return the stored task design as a (respondents, tasks, elements) uint8 array, or None."""
+        shape = (self.step3a_data or {}).get('shape')
+        if not self.step3a_blob or not shape:
+            return None
+        packed = np.frombuffer(self.step3a_blob, dtype=np.uint8)
+        return np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape)
+    
+    @staticmethod
+    def _is_step_data_complete(step, step_data):
+        """Check whether a step's stored data counts as complete."""
         # For layer-specific steps, check if they have meaningful data
         if step == '1c_layer':
             # Check if num_categories is set
@@ -63,61 +130,74 @@ class StudyDraft(Document):
             # For other steps, check if any data exists
             return bool(step_data)
     
+    def get_completion_mask(self):
+        """Return the completed-steps bitmask, deriving it from step data for older drafts."""
+        if self.completion_mask is None:
+            mask = 0
+            for step, bit in STEP_BITS.items():
+                if self._is_step_data_complete(step, self.get_step_data(step) or {}):
+                    mask |= bit
+            self.completion_mask = mask
+        return self.completion_mask
+    
+    def _mask_with_step(self, step, data):
+        """Return the completion mask as it will be once `data` is stored for `step`."""
+        mask = self.get_completion_mask()
+        bit = STEP_BITS.get(step, 0)
+        if self._is_step_data_complete(step, data or {}):
+            return mask | bit
+        return mask & ~bit
+    
+    def is_step_complete(self, step):
+        """Check if a specific step is complete."""
+        bit = STEP_BITS.get(step)
+        if bit is None:
+            return self._is_step_data_complete(step, self.get_step_data(step) or {})
+        return bool(self.get_completion_mask() & bit)
+    
+    def get_step_order(self):
+        """Return the step sequence for this draft's study type."""
+        if self.get_step_data('1b').get('study_type', 'grid') == 'layer':
+            return LAYER_STEP_ORDER
+        return GRID_STEP_ORDER
+    
     def can_proceed_to_step(self, target_step):
         """Check if user can proceed to a specific step."""
-        # Get study type to determine the correct flow
-        study_type = self.get_step_data('1b').get('study_type', 'grid')
-        
-        if study_type == 'layer':
-            step_order = ['1a', '1b', '1c', '1c_layer', '2a_layer', '2b', '2c', '3a', '3b']
-        else:
-            step_order = ['1a', '1b', '1c', '2a', '2b', '2c', '3a', '3b']
-            
+        step_order = self.get_step_order()
         if target_step not in step_order:
             return False
-            
-        target_index = step_order.index(target_step)
         
         # For forward navigation, require previous steps to be complete
-        for i in range(target_index):
-            if not self.is_step_complete(step_order[i]):
-                return False
-        return True
+        required = _steps_mask(*step_order[:step_order.index(target_step)])
+        return (self.get_completion_mask() & required) == required
     
     def can_access_step(self, target_step):
         """Check if user can access a specific step (for navigation)."""
-        # Get study type to determine the correct flow
-        study_type = self.get_step_data('1b').get('study_type', 'grid')
-        
-        if study_type == 'layer':
-            step_order = ['1a', '1b', '1c', '1c_layer', '2a_layer', '2b', '2c', '3a', '3b']
-        else:
-            step_order = ['1a', '1b', '1c', '2a', '2b', '2c', '3a', '3b']
-            
+        step_order = self.get_step_order()
         if target_step not in step_order:
             return False
-            
-        target_index = step_order.index(target_step)
         
         # For navigation (including going back), allow access to completed steps
-        if target_index == 0:  # step1a
+        if target_step == step_order[0]:  # step1a
             return True
-        elif target_index == 1:  # step1b
-            return self.is_step_complete('1a')
-        elif target_step == '1c':  # step1c (Rating Scale) - common for both study types
-            return self.is_step_complete('1a') and self.is_step_complete('1b')
-        elif target_step == '1c_layer':  # step1c_layer (Categories) - only for layer studies
-            return self.is_step_complete('1a') and self.is_step_complete('1b') and self.is_step_complete('1c')
-        elif target_step in ['2a', '2a_layer']:  # Elements step (varies by study type)
-            if target_step == '2a':  # Grid study elements
-                return self.is_step_complete('1a') and self.is_step_complete('1b') and self.is_step_complete('1c')
-            else:  # Layer study categories & elements
-                return self.is_step_complete('1a') and self.is_step_complete('1b') and self.is_step_complete('1c') and self.is_step_complete('1c_layer')
-        else:  # steps 2b and beyond
-            return (self.is_step_complete('1a') and self.is_step_complete('1b') and 
-                   self.is_step_complete('1c') and
-                   (self.is_step_complete('1c_layer') or True) and  # 1c_layer only required for layer studies
-                   (self.is_step_complete('2a') or self.is_step_complete('2a_layer')))
+        required, any_of = _ACCESS_REQUIREMENTS.get(target_step, _LATER_STEP_REQUIREMENTS)
+        mask = self.get_completion_mask()
+        return (mask & required) == required and (not any_of or bool(mask & any_of))
+    
+    def get_all_step_data(self):
+        """Get every step's data in one pass, keyed by step id ('1a', '2a_layer', ...)."""
+        return {
+            '1a': self.step1a_data or {},
+            '1b': self.step1b_data or {},
+            '1c': self.step1c_data or {},
+            '1c_layer': self.step1c_layer_data or {},
+            '2a': self.step2a_data or {},
+            '2a_layer': self.step2a_layer_data or {},
+            '2b': self.step2b_data or {},
+            '2c': self.step2c_data or {},
+            '3a': self.step3a_data or {},
+            '3b': self.step3b_data or {}
+        }
     
     def get_all_data(self):
         """Get all collected data as a dictionary."""
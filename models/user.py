@@ -3,6 +3,13 @@ from flask_login import UserMixin
 from datetime import datetime
 import bcrypt
 import uuid
+from utils.cache import cache
+
+# Flask-Login's user loader reads through the shared cache so authenticated
+# requests don't each cost a MongoDB round-trip. Entries are dropped for every
+# worker whenever the user document is written; the timeout only bounds how
+# long a write made outside invalidate_user can go unnoticed.
+USER_CACHE_TIMEOUT = 60
 
 class User(Document, UserMixin):
     """User model for study creators with authentication."""
@@ -25,6 +32,8 @@ class User(Document, UserMixin):
     
     meta = {
         'collection': 'users',
+        # Indexes are built by `flask ensure-indexes`, not by each worker on first use
+        'auto_create_index': False,
         'indexes': [
             'username',
             'email',
@@ -64,3 +73,22 @@ class User(Document, UserMixin):
     
     def __repr__(self):
         return f'<User {self.username}>'
+
+def _user_cache_key(user_id):
+    return f'user:{user_id}'
+
+def load_cached_user(user_id):
+    """Return the User for user_id, served from the shared cache when possible."""
+    key = _user_cache_key(user_id)
+    user = cache.get(key)
+    if user is not None:
+        return user
+    
+    user = User.objects(_id=user_id).first()
+    if user is not None:
+        cache.set(key, user, timeout=USER_CACHE_TIMEOUT)
+    return user
+
+def invalidate_user(user_id):
+    """Drop a cached user so the next request, on any worker, reloads it from MongoDB."""
+    cache.delete(_user_cache_key(user_id))
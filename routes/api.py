@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request, current_app
 from flask_login import login_required, current_user
-from models.study import Study
+from models.study import Study, invalidate_study, save_task_plans
+from utils import background
 from models.response import StudyResponse, TaskSession
 from datetime import datetime, timedelta
 import json
@@ -366,6 +367,8 @@ def regenerate_tasks(study_id):
         # Regenerate task matrix
         new_tasks = study.generate_tasks()
         study.save()
+        invalidate_study(study._id)
+        background.submit(save_task_plans, study._id)
         
         return jsonify({
             'success': True,
@@ -1,7 +1,7 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash
-from models.user import User
+from models.user import User, invalidate_user
 from forms.auth import LoginForm, RegistrationForm, PasswordResetRequestForm, PasswordResetForm, ProfileUpdateForm
 from datetime import datetime
 
@@ -15,17 +15,16 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
-        print(f"Login attempt for username: {form.username.data}")  # Debug
         user = User.objects(username=form.username.data).first()
-        print(f"User found: {user is not None}")  # Debug
-        if user:
-            print(f"Password check result: {user.check_password(form.password.data)}")  # Debug
+        current_app.logger.debug("Login attempt for username %s (user found: %s)",
+                                 form.username.data, user is not None)
         if user and user.check_password(form.password.data):
             # Make session permanent for long-term login
             session.permanent = True
             login_user(user, remember=form.remember_me.data)
             user.last_login = datetime.utcnow()
             user.save()
+            invalidate_user(user._id)
             
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
@@ -63,6 +62,7 @@ def register():
 @login_required
 def logout():
     """User logout route."""
+    invalidate_user(current_user._id)
     logout_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
@@ -80,6 +80,7 @@ def profile():
         current_user.date_of_birth = form.date_of_birth.data or None
         current_user.updated_at = datetime.utcnow()
         current_user.save()
+        invalidate_user(current_user._id)
         
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('auth.profile'))
@@ -101,6 +102,7 @@ def change_password():
         current_user.set_password(form.password.data)
         current_user.updated_at = datetime.utcnow()
         current_user.save()
+        invalidate_user(current_user._id)
         
         flash('Password changed successfully!', 'success')
         return redirect(url_for('auth.profile'))
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
-from models.study import Study
+from models.study import Study, RespondentTaskPlan, invalidate_study
+from models.user import User, invalidate_user
 from models.response import StudyResponse, TaskSession
 from datetime import datetime, timedelta
 import json
@@ -360,6 +361,7 @@ def edit_study(study_id):
             study.orientation_text = request.form.get('orientation_text', study.orientation_text)
             study.updated_at = datetime.utcnow()
             study.save()
+            invalidate_study(study._id)
             
             flash('Study updated successfully!', 'success')
             return redirect(url_for('dashboard.study_detail', study_id=study._id))
@@ -390,6 +392,7 @@ def change_study_status(study_id):
         
         study.updated_at = datetime.utcnow()
         study.save()
+        invalidate_study(study._id)
         
         return jsonify({'success': True, 'status': new_status})
         
@@ -479,13 +482,16 @@ def delete_study(study_id):
         # Delete associated responses and task sessions
         StudyResponse.objects(study=study).delete()
         TaskSession.objects(study_response__study=study).delete()
+        RespondentTaskPlan.objects(study_id=study._id).delete()
         
-        # Remove from user's studies list
-        current_user.studies.remove(study)
-        current_user.save()
+        # Remove from user's studies list (atomic $pull; current_user may be a
+        # cached instance whose list is stale)
+        User.objects(_id=current_user._id).update_one(pull__studies=study)
+        invalidate_user(current_user._id)
         
         # Delete the study
         study.delete()
+        invalidate_study(study._id)
         
         return jsonify({'success': True})
         
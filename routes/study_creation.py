@@ -1,48 +1,323 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app, jsonify, make_response
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import os
+import re
+import time
+import hashlib
+import logging
 import uuid
-from datetime import datetime
-from models.study import Study, RatingScale, StudyElement, ClassificationQuestion, IPEDParameters
-from models.study_draft import StudyDraft
+from collections import defaultdict
+from io import BytesIO
+from datetime import datetime, timedelta
+from mongoengine.queryset.visitor import Q
+import numpy as np
+from models.study import (
+    Study, RatingScale, StudyElement, LayerCategory, ClassificationQuestion, IPEDParameters,
+    generate_task_design, build_task_matrix, save_task_plans
+)
+from models.study_draft import STEP_BITS, StudyDraft
+from models.user import User, invalidate_user
 from forms.study import (
     Step1aBasicDetailsForm, Step1bStudyTypeForm, Step1cRatingScaleForm,
     Step2cIPEDParametersForm, Step3aTaskGenerationForm, Step3bLaunchForm,
     LayerStudyCategoryForm
 )
-from utils.azure_storage import upload_to_azure, is_valid_image_file, get_file_size_mb
+from utils.azure_storage import upload_to_azure, is_valid_image_file, has_image_signature
+from utils import background
+from utils.cache import cache
 
 study_creation_bp = Blueprint('study_creation', __name__, url_prefix='/study/create')
 
-def get_study_draft():
-    """Get or create study creation draft in database."""
-    # Try to get existing draft
-    draft = StudyDraft.objects(user=current_user, is_complete=False).order_by('-created_at').first()
+# Step ids in creation order; each has a view named step<id>
+STEP_IDS = tuple(STEP_BITS)
+
+# Per-image size limit and the chunk size used when reading uploads
+MAX_IMAGE_BYTES = 16 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Element images are uploaded to Azure in the background; until an upload
+# finishes, the element's content holds a pending://<started>-<id> placeholder.
+# Jobs live in memory, so a placeholder older than UPLOAD_PENDING_TIMEOUT
+# seconds is cleared and the image has to be uploaded again. Step 3b can't
+# launch while uploads are outstanding; its page polls step3b_upload_status.
+PENDING_UPLOAD_PREFIX = 'pending://'
+UPLOAD_PENDING_TIMEOUT = 600
+
+# Dynamic form field names, e.g. element_3_name / question_1_option_2
+ELEMENT_FIELD_RE = re.compile(r'^element_(\d+)_(\w+)$')
+QUESTION_FIELD_RE = re.compile(r'^question_(\d+)_(\w+)$')
+
+# current_step markers while step 3a's task matrix is generated in the background;
+# a job still pending after GENERATION_TIMEOUT is treated as failed
+GENERATION_PENDING_STEP = '3a_pending'
+GENERATION_FAILED_STEP = '3a_failed'
+GENERATION_TIMEOUT = timedelta(minutes=5)
+
+# Draft fields holding the generated task matrix (packed design, or the
+# legacy per-task dicts), skipped unless a view needs them
+TASK_MATRIX_FIELDS = ('step3a_blob', 'step3a_data.tasks_matrix')
+
+def group_indexed_fields(form, pattern):
+    """Group indexed form fields in one pass: element_3_name -> {3: {'name': value}}."""
+    groups = defaultdict(dict)
+    for key, value in form.items():
+        match = pattern.match(key)
+        if match:
+            groups[int(match.group(1))][match.group(2)] = value
+    return groups
+
+def get_study_draft(include_tasks_matrix=False):
+    """Get or create study creation draft in database.
+    
+    The generated task matrix is by far the largest part of a draft, so it is
+    left out unless include_tasks_matrix is set.
+    """
+    # Try to get existing draft; draft.user is never read, so don't fetch the User
+    drafts = StudyDraft.objects(user=current_user, is_complete=False).order_by('-created_at').no_dereference()
+    if not include_tasks_matrix:
+        drafts = drafts.exclude(*TASK_MATRIX_FIELDS)
+    draft = drafts.first()
     
     if not draft:
         # Create new draft
-        draft = StudyDraft(user=current_user, current_step='1a')
+        draft = StudyDraft(user=current_user, current_step='1a', completion_mask=0)
         draft.save()
     
     return draft
 
-def save_uploaded_file(file, study_id):
-    """Save uploaded file to Azure Blob Storage and return URL."""
-    if file and file.filename:
-        # Validate file type
-        if not is_valid_image_file(file.filename):
-            return None
-        
-        # Check file size (max 16MB)
-        file_size_mb = get_file_size_mb(file)
-        if file_size_mb > 16:
+def render_step(template, draft, **context):
+    """Render a step page, answering repeat GETs with 304 Not Modified.
+    
+    The ETag covers the draft's last update, the session's CSRF token and the
+    token's validity window, so a cached page never shows stale data or submits
+    an expired token. Pages that would show flashed messages are always rendered.
+    """
+    if request.method != 'GET' or '_flashes' in session:
+        return render_template(template, draft=draft, **context)
+    
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT')
+    csrf_window = int(time.time() // (time_limit // 2)) if time_limit else 0
+    etag = hashlib.sha1('|'.join((
+        str(draft.pk), draft.updated_at.isoformat(), request.full_path,
+        session.get('csrf_token', ''), str(csrf_window)
+    )).encode('utf-8')).hexdigest()
+    
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render_template(template, draft=draft, **context))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def read_uploaded_image(file):
+    """Validate an uploaded image and read it into an in-memory buffer (None if invalid)."""
+    if not file or not file.filename:
+        return None
+    
+    # Validate file type
+    if not is_valid_image_file(file.filename):
+        return None
+    
+    # Reject files whose content isn't actually an image before reading the rest
+    chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+    if not has_image_signature(chunk[:12]):
+        return None
+    
+    # Copy out of the werkzeug FileStorage in a single pass (so the bytes can
+    # be handed to another thread safely), enforcing the 16MB limit as we go
+    buffer = BytesIO()
+    while chunk:
+        if buffer.tell() + len(chunk) > MAX_IMAGE_BYTES:
             return None
-        
-        # Upload to Azure
-        azure_url = upload_to_azure(file)
-        return azure_url
-    return None
+        buffer.write(chunk)
+        chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+    buffer.seek(0)
+    return buffer
+
+def new_upload_placeholder():
+    """Return a unique placeholder URL for an image whose upload hasn't finished."""
+    return f'{PENDING_UPLOAD_PREFIX}{int(time.time())}-{uuid.uuid4().hex}'
+
+def is_pending_upload(content):
+    return str(content or '').startswith(PENDING_UPLOAD_PREFIX)
+
+def is_stale_upload(placeholder):
+    """True if a placeholder's upload should have finished long ago (or predates timestamped placeholders)."""
+    started = placeholder[len(PENDING_UPLOAD_PREFIX):].split('-', 1)[0]
+    return not started.isdigit() or time.time() - int(started) > UPLOAD_PENDING_TIMEOUT
+
+def _upload_cache_key(placeholder):
+    return f'upload:{placeholder}'
+
+def resolve_current_image(submitted, stored):
+    """Return the content to keep for an element submitted without a new image.
+    
+    Placeholders are never taken from the form: the element keeps its stored
+    content (the uploaded URL if the upload finished meanwhile). A placeholder
+    that is stale or whose upload failed resolves to '', so the image has to be
+    uploaded again.
+    """
+    content = stored if is_pending_upload(submitted) else submitted
+    if is_pending_upload(content):
+        result = cache.get(_upload_cache_key(content))
+        if result is not None:
+            return result
+        if is_stale_upload(content):
+            return ''
+    return content or ''
+
+def upload_draft_image(draft_id, elements_path, placeholder, buffer, filename):
+    """Background job: upload an element image and swap its URL in for the placeholder.
+    
+    elements_path is the step data array holding the element, e.g.
+    'step2a_data.elements'. Nothing is written if no element carries the
+    placeholder any more (the step was resubmitted meanwhile). A failed upload
+    clears the content so the image has to be uploaded again.
+    """
+    azure_url = upload_to_azure(buffer, filename)
+    if not azure_url:
+        current_app.logger.error('Failed to upload image %s for draft %s', filename, draft_id)
+    
+    # Also remember the result, so a step resubmitted while this upload was in
+    # flight (which writes the placeholder back) can still pick it up
+    cache.set(_upload_cache_key(placeholder), azure_url or '', timeout=UPLOAD_PENDING_TIMEOUT)
+    set_draft_image(draft_id, elements_path, placeholder, azure_url or '')
+
+def set_draft_image(draft_id, elements_path, placeholder, content):
+    """Replace a placeholder with content in every draft element that still carries it."""
+    StudyDraft._get_collection().update_one(
+        {'_id': draft_id, f"{elements_path.replace('.$[]', '')}.content": placeholder},
+        {'$set': {
+            f'{elements_path}.$[element].content': content,
+            'updated_at': datetime.utcnow()
+        }},
+        array_filters=[{'element.content': placeholder}]
+    )
+
+def queue_image_uploads(draft_id, elements_path, uploads):
+    """Upload [(placeholder, buffer, filename)] in the background.
+    
+    Call only after the placeholders have been saved to the draft.
+    """
+    for placeholder, buffer, filename in uploads:
+        background.submit(upload_draft_image, draft_id, elements_path, placeholder, buffer, filename)
+
+def get_step_elements(steps, study_type):
+    """Return the element dicts of the draft's elements step for the study type."""
+    if study_type == 'grid':
+        return steps['2a'].get('elements', [])
+    return [element for category in steps['2a_layer'].get('categories', [])
+            for element in category.get('elements', [])]
+
+def get_elements_path(study_type):
+    """Return the draft array path holding the elements of the study type's elements step."""
+    return 'step2a_data.elements' if study_type == 'grid' else 'step2a_layer_data.categories.$[].elements'
+
+def settle_image_uploads(draft, steps, study_type):
+    """Resolve finished, failed and stale upload placeholders in the draft and in steps.
+    
+    Returns True if some uploads are still legitimately in flight.
+    """
+    pending = False
+    for element in get_step_elements(steps, study_type):
+        placeholder = element.get('content', '')
+        if not is_pending_upload(placeholder):
+            continue
+        content = resolve_current_image(placeholder, placeholder)
+        if is_pending_upload(content):
+            pending = True
+            continue
+        set_draft_image(draft.pk, get_elements_path(study_type), placeholder, content)
+        element['content'] = content
+    return pending
+
+def generate_tasks_for_draft(draft_id, step2c_data, regenerate_matrix, claimed_at):
+    """Background job: generate a draft's IPED task design and store it as step 3a.
+    
+    Results are only written while the draft still holds the claim made at
+    `claimed_at`; a draft that was reset, re-claimed or moved on keeps its state.
+    """
+    try:
+        number_of_respondents = step2c_data['number_of_respondents']
+        tasks_per_consumer = step2c_data['tasks_per_consumer']
+        num_elements = step2c_data['num_elements']
+        design = generate_task_design(
+            num_elements,
+            number_of_respondents * tasks_per_consumer,
+            step2c_data['min_active_elements'],
+            step2c_data['max_active_elements']
+        )
+    except Exception:
+        current_app.logger.exception('Task matrix generation failed for draft %s', draft_id)
+        StudyDraft.objects(pk=draft_id, current_step=GENERATION_PENDING_STEP, updated_at=claimed_at).update_one(
+            set__current_step=GENERATION_FAILED_STEP,
+            set__updated_at=datetime.utcnow()
+        )
+        return
+    
+    draft = StudyDraft.objects(pk=draft_id).exclude(*TASK_MATRIX_FIELDS).no_dereference().first()
+    if draft is None:
+        # Draft was reset while generating
+        return
+    # Only the 0/1 design is stored, bit-packed; the per-task dicts are rebuilt
+    # from it (with step 2a's element content) when they are needed
+    step3a_data = {
+        'shape': [number_of_respondents, tasks_per_consumer, num_elements],
+        'generated_at': datetime.utcnow(),
+        'regenerate_matrix': regenerate_matrix
+    }
+    stored = StudyDraft.objects(pk=draft_id, current_step=GENERATION_PENDING_STEP, updated_at=claimed_at).update_one(
+        set__step3a_data=step3a_data,
+        set__step3a_blob=np.packbits(design).tobytes(),
+        set__current_step='3b',
+        set__completion_mask=draft._mask_with_step('3a', step3a_data),
+        set__updated_at=datetime.utcnow()
+    )
+    if not stored:
+        current_app.logger.info('Discarding task matrix for draft %s: generation claim no longer held', draft_id)
+
+def start_task_generation(draft, steps, regenerate_matrix=False):
+    """Mark the draft as generating and queue its task matrix generation.
+    
+    Returns False if a generation for this draft is already running.
+    """
+    now = datetime.utcnow()
+    # MongoDB keeps milliseconds; truncate so the job can match its claim exactly
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    # Claim the draft atomically so concurrent submits don't queue duplicate jobs
+    claimed = StudyDraft.objects(
+        Q(current_step__ne=GENERATION_PENDING_STEP) | Q(updated_at__lt=now - GENERATION_TIMEOUT),
+        pk=draft.pk
+    ).update_one(set__current_step=GENERATION_PENDING_STEP, set__updated_at=now)
+    if not claimed:
+        return False
+    
+    draft.current_step = GENERATION_PENDING_STEP
+    draft.updated_at = now
+    draft._clear_changed_fields()
+    background.submit(generate_tasks_for_draft, draft.pk, steps['2c'], regenerate_matrix, now)
+    return True
+
+def get_generation_status(draft):
+    """Return 'pending', 'failed' or 'ready' for the draft's task matrix (None if never generated)."""
+    if draft.current_step == GENERATION_PENDING_STEP:
+        # Jobs are in-process, so one that outlives the timeout died with its worker
+        if datetime.utcnow() - draft.updated_at < GENERATION_TIMEOUT:
+            return 'pending'
+        return 'failed'
+    if draft.current_step == GENERATION_FAILED_STEP:
+        return 'failed'
+    return 'ready' if draft.is_step_complete('3a') else None
+
+def get_draft_tasks_matrix(draft, steps):
+    """Return the draft's task matrix in Study.tasks form, or None if it hasn't been generated."""
+    design = draft.get_task_design()
+    if design is not None:
+        return build_task_matrix(design, [element.get('content', '') for element in steps['2a'].get('elements', [])])
+    # Drafts generated before the design was stored packed
+    return steps['3a'].get('tasks_matrix')
 
 @study_creation_bp.route('/')
 @login_required
@@ -62,29 +337,10 @@ def navigate_to_step(step_id):
         return redirect(url_for('study_creation.index'))
     
     # Redirect to the appropriate step route
-    if step_id == '1a':
-        return redirect(url_for('study_creation.step1a'))
-    elif step_id == '1b':
-        return redirect(url_for('study_creation.step1b'))
-    elif step_id == '1c':
-        return redirect(url_for('study_creation.step1c'))
-    elif step_id == '1c_layer':
-        return redirect(url_for('study_creation.step1c_layer'))
-    elif step_id == '2a':
-        return redirect(url_for('study_creation.step2a'))
-    elif step_id == '2a_layer':
-        return redirect(url_for('study_creation.step2a_layer'))
-    elif step_id == '2b':
-        return redirect(url_for('study_creation.step2b'))
-    elif step_id == '2c':
-        return redirect(url_for('study_creation.step2c'))
-    elif step_id == '3a':
-        return redirect(url_for('study_creation.step3a'))
-    elif step_id == '3b':
-        return redirect(url_for('study_creation.step3b'))
-    else:
-        flash('Invalid step specified.', 'error')
-        return redirect(url_for('study_creation.index'))
+    if step_id in STEP_IDS:
+        return redirect(url_for(f'study_creation.step{step_id}'))
+    flash('Invalid step specified.', 'error')
+    return redirect(url_for('study_creation.index'))
 
 @study_creation_bp.route('/step1a', methods=['GET', 'POST'])
 @login_required
@@ -103,28 +359,19 @@ def step1a():
             flash('Please complete previous steps first.', 'warning')
             return redirect(url_for('study_creation.index'))
     
-    form = Step1aBasicDetailsForm()
+    # Pre-populate form if data exists (submitted values take precedence)
+    form = Step1aBasicDetailsForm(data=draft.get_step_data('1a'))
     if form.validate_on_submit():
-        draft.update_step_data('1a', {
+        draft.update_step_and_advance('1a', {
             'title': form.title.data,
             'background': form.background.data,
             'language': form.language.data,
             'terms_accepted': form.terms_accepted.data
-        })
-        draft.current_step = '1b'
-        draft.save()
+        }, '1b')
         flash('Basic details saved successfully!', 'success')
         return redirect(url_for('study_creation.step1b'))
     
-    # Pre-populate form if data exists
-    step_data = draft.get_step_data('1a')
-    if step_data:
-        form.title.data = step_data.get('title', '')
-        form.background.data = step_data.get('background', '')
-        form.language.data = step_data.get('language', 'en')
-        form.terms_accepted.data = step_data.get('terms_accepted', False)
-    
-    return render_template('study_creation/step1a.html', form=form, current_step='1a', draft=draft)
+    return render_step('study_creation/step1a.html', draft, form=form, current_step='1a')
 
 @study_creation_bp.route('/step1b', methods=['GET', 'POST'])
 @login_required
@@ -143,29 +390,20 @@ def step1b():
             flash('Please complete previous steps first.', 'warning')
             return redirect(url_for('study_creation.step1a'))
     
-    form = Step1bStudyTypeForm()
+    # Pre-populate form if data exists (submitted values take precedence)
+    form = Step1bStudyTypeForm(data=draft.get_step_data('1b'))
     if form.validate_on_submit():
         study_type = form.study_type.data
-        draft.update_step_data('1b', {
+        # Both study types go to step1c (Rating Scale) - it's common for both
+        draft.update_step_and_advance('1b', {
             'study_type': study_type,
             'main_question': form.main_question.data,
             'orientation_text': form.orientation_text.data
-        })
-        
-        # Both study types go to step1c (Rating Scale) - it's common for both
-        draft.current_step = '1c'
-        draft.save()
+        }, '1c')
         flash('Study type and questions saved successfully!', 'success')
         return redirect(url_for('study_creation.step1c'))
     
-    # Pre-populate form if data exists
-    step_data = draft.get_step_data('1b')
-    if step_data:
-        form.study_type.data = step_data.get('study_type', 'image')
-        form.main_question.data = step_data.get('main_question', '')
-        form.orientation_text.data = step_data.get('orientation_text', '')
-    
-    return render_template('study_creation/step1b.html', form=form, current_step='1b', draft=draft)
+    return render_step('study_creation/step1b.html', draft, form=form, current_step='1b')
 
 @study_creation_bp.route('/step1c', methods=['GET', 'POST'])
 @login_required
@@ -184,39 +422,24 @@ def step1c():
             flash('Please complete previous steps first.', 'warning')
             return redirect(url_for('study_creation.step1b'))
     
-    form = Step1cRatingScaleForm()
+    # Pre-populate form if data exists (submitted values take precedence)
+    form = Step1cRatingScaleForm(data=draft.get_step_data('1c'))
     if form.validate_on_submit():
-        draft.update_step_data('1c', {
+        # Next step depends on study type
+        study_type = draft.get_step_data('1b').get('study_type', 'grid')
+        next_step = '2a' if study_type == 'grid' else '1c_layer'
+        draft.update_step_and_advance('1c', {
             'min_value': form.min_value.data,
             'max_value': form.max_value.data,
             'min_label': form.min_label.data,
             'max_label': form.max_label.data,
             'middle_label': form.middle_label.data
-        })
+        }, next_step)
         
-        # Redirect based on study type
-        study_type = draft.get_step_data('1b').get('study_type', 'grid')
-        if study_type == 'grid':
-            draft.current_step = '2a'
-            draft.save()
-            flash('Rating scale configuration saved successfully!', 'success')
-            return redirect(url_for('study_creation.step2a'))
-        else:  # layer study
-            draft.current_step = '1c_layer'
-            draft.save()
-            flash('Rating scale configuration saved successfully!', 'success')
-            return redirect(url_for('study_creation.step1c_layer'))
-    
-    # Pre-populate form if data exists
-    step_data = draft.get_step_data('1c')
-    if step_data:
-        form.min_value.data = step_data.get('min_value', 1)
-        form.max_value.data = step_data.get('max_value', 5)
-        form.min_label.data = step_data.get('min_label', '')
-        form.max_label.data = step_data.get('max_label', '')
-        form.middle_label.data = step_data.get('middle_label', '')
+        flash('Rating scale configuration saved successfully!', 'success')
+        return redirect(url_for(f'study_creation.step{next_step}'))
     
-    return render_template('study_creation/step1c.html', form=form, current_step='1c', draft=draft)
+    return render_step('study_creation/step1c.html', draft, form=form, current_step='1c')
 
 @study_creation_bp.route('/step1c_layer', methods=['GET', 'POST'])
 @login_required
@@ -233,23 +456,17 @@ def step1c_layer():
             flash('Please complete previous steps first.', 'warning')
             return redirect(url_for('study_creation.step1b'))
     
-    form = LayerStudyCategoryForm()
+    # Pre-populate form if data exists (submitted values take precedence)
+    form = LayerStudyCategoryForm(data=draft.get_step_data('1c_layer'))
     if form.validate_on_submit():
         num_categories = form.num_categories.data
-        draft.update_step_data('1c_layer', {
+        draft.update_step_and_advance('1c_layer', {
             'num_categories': num_categories
-        })
-        draft.current_step = '2a_layer'
-        draft.save()
+        }, '2a_layer')
         flash(f'Category setup saved! You will configure {num_categories} categories.', 'success')
         return redirect(url_for('study_creation.step2a_layer'))
     
-    # Pre-populate form if data exists
-    step_data = draft.get_step_data('1c_layer')
-    if step_data:
-        form.num_categories.data = step_data.get('num_categories', 2)
-    
-    return render_template('study_creation/step1c_layer.html', form=form, current_step='1c_layer', draft=draft)
+    return render_step('study_creation/step1c_layer.html', draft, form=form, current_step='1c_layer')
 
 @study_creation_bp.route('/step2a', methods=['GET', 'POST'])
 @login_required
@@ -273,37 +490,40 @@ def step2a():
     if request.method == 'POST':
         # Handle dynamic form submission
         elements_data = []
+        uploads = []
         num_elements = int(request.form.get('num_elements', 4))
+        element_fields = group_indexed_fields(request.form, ELEMENT_FIELD_RE)
+        stored_elements = (draft.get_step_data('2a') or {}).get('elements', [])
         
         for i in range(num_elements):
+            fields = element_fields.get(i, {})
             element_data = {
                 'element_id': f"E{i+1}",
-                'name': request.form.get(f'element_{i}_name', ''),
-                'description': request.form.get(f'element_{i}_description', ''),
-                'alt_text': request.form.get(f'element_{i}_alt_text', '')
+                'name': fields.get('name', ''),
+                'description': fields.get('description', ''),
+                'alt_text': fields.get('alt_text', '')
             }
             
             # All elements are always images by default
             file = request.files.get(f'element_{i}_image')
-            current_image = request.form.get(f'element_{i}_current_image', '')
+            stored_content = stored_elements[i].get('content', '') if i < len(stored_elements) else ''
+            current_image = resolve_current_image(fields.get('current_image', ''), stored_content)
             
             if file and file.filename:
-                # New image uploaded - upload to Azure and get URL
-                azure_url = save_uploaded_file(file, f"element_{i}")
-                if azure_url:
-                    element_data['content'] = azure_url
-                    element_data['element_type'] = 'image'
-                    print(f"DEBUG: Uploaded image for element {i+1}: {azure_url}")
-                else:
+                # New image uploaded - validate now, upload to Azure in the background once saved
+                buffer = read_uploaded_image(file)
+                if buffer is None:
                     flash(f'Failed to upload image for element {i+1}. Please check file type and size.', 'error')
                     return render_template('study_creation/step2a.html', 
                                         study_type=study_type, num_elements=num_elements, 
                                         elements_data=elements_data, current_step='2a')
+                element_data['content'] = new_upload_placeholder()
+                element_data['element_type'] = 'image'
+                uploads.append((element_data['content'], buffer, file.filename))
             elif current_image:
                 # No new image, but current image exists - keep the current image
                 element_data['content'] = current_image
                 element_data['element_type'] = 'image'
-                print(f"DEBUG: Using existing image for element {i+1}: {current_image}")
             else:
                 # No image at all - this is required for all elements
                 flash(f'Image file is required for element {i+1}', 'error')
@@ -313,32 +533,28 @@ def step2a():
             
             elements_data.append(element_data)
         
-        # Debug: Print what we're about to save
-        print(f"DEBUG: Saving elements to draft:")
-        for i, elem in enumerate(elements_data):
-            print(f"DEBUG: Element {i}: {elem}")
+        logger = current_app.logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Saving %d elements to draft %s: %s", len(elements_data), draft._id, elements_data)
         
-        draft.update_step_data('2a', {
+        draft.update_step_and_advance('2a', {
             'elements': elements_data,
             'study_type': study_type,
             'num_elements': num_elements
-        })
-        draft.current_step = '2b'
-        draft.save()
-        
-        # Debug: Verify what was saved
-        saved_data = draft.get_step_data('2a')
-        print(f"DEBUG: Saved data: {saved_data}")
+        }, '2b')
+        queue_image_uploads(draft.pk, get_elements_path('grid'), uploads)
         
         flash('Study elements saved successfully!', 'success')
         return redirect(url_for('study_creation.step2b'))
     
+    existing_data = draft.get_step_data('2a')
+    settle_image_uploads(draft, {'2a': existing_data or {}}, 'grid')
+    
     # Get number of elements from form or previous data or default
     if request.args.get('num_elements'):
         num_elements = int(request.args.get('num_elements'))
     else:
         # Try to get from existing step2a data
-        existing_data = draft.get_step_data('2a')
         if existing_data and 'elements' in existing_data:
             # Prioritize the stored num_elements value over the existing elements count
             stored_num_elements = existing_data.get('num_elements', 4)
@@ -347,16 +563,16 @@ def step2a():
             num_elements = stored_num_elements if stored_num_elements > 0 else max(existing_count, 4)
         else:
             num_elements = 4
-    elements_data = draft.get_step_data('2a').get('elements', []) if draft.get_step_data('2a') else []
+    elements_data = existing_data.get('elements', []) if existing_data else []
     
-    # Debug logging
-    print(f"DEBUG: num_elements = {num_elements}")
-    print(f"DEBUG: elements_data length = {len(elements_data) if elements_data else 0}")
-    print(f"DEBUG: existing_data = {draft.get_step_data('2a')}")
+    logger = current_app.logger
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Step 2a: num_elements=%d, %d stored elements, existing_data=%s",
+                     num_elements, len(elements_data), existing_data)
     
-    return render_template('study_creation/step2a.html', 
+    return render_step('study_creation/step2a.html', draft, 
                          study_type=study_type, num_elements=num_elements, 
-                         elements_data=elements_data, current_step='2a', draft=draft)
+                         elements_data=elements_data, current_step='2a')
 
 @study_creation_bp.route('/step2a_layer', methods=['GET', 'POST'])
 @login_required
@@ -386,6 +602,8 @@ def step2a_layer():
     if request.method == 'POST':
         # Handle dynamic form submission for categories
         categories_data = []
+        uploads = []
+        stored_categories = (draft.get_step_data('2a_layer') or {}).get('categories', [])
         
         for i in range(num_categories):
             category_id = chr(65 + i)  # A, B, C, D, etc.
@@ -393,6 +611,7 @@ def step2a_layer():
             num_elements = int(request.form.get(f'category_{i}_num_elements', 4))
             
             category_elements = []
+            stored_elements = stored_categories[i].get('elements', []) if i < len(stored_categories) else []
             for j in range(num_elements):
                 element_data = {
                     'element_id': f"{category_id}{j+1}",
@@ -403,17 +622,20 @@ def step2a_layer():
                 
                 # Handle image file upload to Azure
                 file = request.files.get(f'category_{i}_element_{j}_image')
-                current_image = request.form.get(f'category_{i}_element_{j}_current_image', '')
+                stored_content = stored_elements[j].get('content', '') if j < len(stored_elements) else ''
+                current_image = resolve_current_image(
+                    request.form.get(f'category_{i}_element_{j}_current_image', ''), stored_content
+                )
                 
                 if file and file.filename:
-                    azure_url = save_uploaded_file(file, f"category_{i}_element_{j}")
-                    if azure_url:
-                        element_data['content'] = azure_url
-                        element_data['element_type'] = 'image'
-                    else:
+                    buffer = read_uploaded_image(file)
+                    if buffer is None:
                         flash(f'Failed to upload image for {category_id}{j+1}. Please check file type and size.', 'error')
                         return render_template('study_creation/step2a_layer.html', 
                                             num_categories=num_categories, current_step='2a_layer')
+                    element_data['content'] = new_upload_placeholder()
+                    element_data['element_type'] = 'image'
+                    uploads.append((element_data['content'], buffer, file.filename))
                 elif current_image:
                     element_data['content'] = current_image
                     element_data['element_type'] = 'image'
@@ -431,23 +653,23 @@ def step2a_layer():
                 'order': i
             })
         
-        draft.update_step_data('2a_layer', {
+        draft.update_step_and_advance('2a_layer', {
             'categories': categories_data,
             'study_type': 'layer'
-        })
-        draft.current_step = '2b'
-        draft.save()
+        }, '2b')
+        queue_image_uploads(draft.pk, get_elements_path('layer'), uploads)
         flash('Layer study categories and elements saved successfully!', 'success')
         return redirect(url_for('study_creation.step2b'))
     
     # Get existing data if available
     existing_data = draft.get_step_data('2a_layer')
+    settle_image_uploads(draft, {'2a_layer': existing_data or {}}, 'layer')
     categories_data = existing_data.get('categories', []) if existing_data else []
     
-    return render_template('study_creation/step2a_layer.html', 
+    return render_step('study_creation/step2a_layer.html', draft, 
                          num_categories=num_categories, 
                          categories_data=categories_data,
-                         current_step='2a_layer', draft=draft)
+                         current_step='2a_layer')
 
 @study_creation_bp.route('/step2b', methods=['GET', 'POST'])
 @login_required
@@ -474,13 +696,16 @@ def step2b():
         # Handle dynamic form submission with individual option fields
         questions_data = []
         num_questions = int(request.form.get('num_questions', 2))
+        question_fields = group_indexed_fields(request.form, QUESTION_FIELD_RE)
         
         for i in range(num_questions):
+            fields = question_fields.get(i, {})
+            
             # Collect all options for this question
             answer_options = []
             option_index = 0
             while True:
-                option_value = request.form.get(f'question_{i}_option_{option_index}')
+                option_value = fields.get(f'option_{option_index}')
                 if option_value is None:  # No more options
                     break
                 if option_value.strip():  # Only add non-empty options
@@ -489,18 +714,16 @@ def step2b():
             
             question_data = {
                 'question_id': f"Q{i+1}",
-                'question_text': request.form.get(f'question_{i}_text', ''),
+                'question_text': fields.get('text', ''),
                 'answer_options': answer_options,
-                'is_required': request.form.get(f'question_{i}_required') == 'on',
+                'is_required': fields.get('required') == 'on',
                 'order': i + 1
             }
             questions_data.append(question_data)
         
-        draft.update_step_data('2b', {
+        draft.update_step_and_advance('2b', {
             'questions': questions_data
-        })
-        draft.current_step = '2c'
-        draft.save()
+        }, '2c')
         flash('Classification questions saved successfully!', 'success')
         return redirect(url_for('study_creation.step2c'))
     
@@ -513,8 +736,8 @@ def step2b():
         num_questions = 2
         questions_data = []
     
-    return render_template('study_creation/step2b.html', 
-                         num_questions=num_questions, questions_data=questions_data, current_step='2b', draft=draft)
+    return render_step('study_creation/step2b.html', draft, 
+                         num_questions=num_questions, questions_data=questions_data, current_step='2b')
 
 @study_creation_bp.route('/step2c', methods=['GET', 'POST'])
 @login_required
@@ -533,51 +756,42 @@ def step2c():
             flash('Please complete previous steps first.', 'warning')
             return redirect(url_for('study_creation.step2b'))
     
-    form = Step2cIPEDParametersForm()
-    
     # Pre-populate from DB if available; otherwise set sensible defaults
-    stored_step2c = draft.get_step_data('2c') or {}
-    if request.method == 'GET':
-        if stored_step2c:
-            form.num_elements.data = stored_step2c.get('num_elements')
-            form.tasks_per_consumer.data = stored_step2c.get('tasks_per_consumer')
-            form.number_of_respondents.data = stored_step2c.get('number_of_respondents')
-            form.min_active_elements.data = stored_step2c.get('min_active_elements')
-            form.max_active_elements.data = stored_step2c.get('max_active_elements')
-        else:
-            # Set default values based on previous step elements count
-            study_type = draft.get_step_data('1b').get('study_type', 'grid')
-            if study_type == 'grid':
-                step2a_data = draft.get_step_data('2a')
-                if step2a_data:
-                    form.num_elements.data = len(step2a_data.get('elements', []))
-            else:  # layer study
-                step2a_layer_data = draft.get_step_data('2a_layer')
-                if step2a_layer_data:
-                    total_elements = sum(len(cat.get('elements', [])) for cat in step2a_layer_data.get('categories', []))
-                    form.num_elements.data = total_elements
+    initial_data = draft.get_step_data('2c') or {}
+    if request.method == 'GET' and not initial_data:
+        # Set default values based on previous step elements count
+        study_type = draft.get_step_data('1b').get('study_type', 'grid')
+        if study_type == 'grid':
+            step2a_data = draft.get_step_data('2a')
+            if step2a_data:
+                initial_data = {'num_elements': len(step2a_data.get('elements', []))}
+        else:  # layer study
+            step2a_layer_data = draft.get_step_data('2a_layer')
+            if step2a_layer_data:
+                total_elements = sum(len(cat.get('elements', [])) for cat in step2a_layer_data.get('categories', []))
+                initial_data = {'num_elements': total_elements}
+    
+    form = Step2cIPEDParametersForm(data=initial_data)
     
     if form.validate_on_submit():
-        draft.update_step_data('2c', {
+        draft.update_step_and_advance('2c', {
             'num_elements': form.num_elements.data,
             'tasks_per_consumer': form.tasks_per_consumer.data,
             'number_of_respondents': form.number_of_respondents.data,
             'min_active_elements': form.min_active_elements.data,
             'max_active_elements': form.max_active_elements.data,
             'total_tasks': form.tasks_per_consumer.data * form.number_of_respondents.data
-        })
-        draft.current_step = '3a'
-        draft.save()
+        }, '3a')
         flash('IPED parameters saved successfully!', 'success')
         return redirect(url_for('study_creation.step3a'))
     
-    return render_template('study_creation/step2c.html', form=form, current_step='2c', draft=draft)
+    return render_step('study_creation/step2c.html', draft, form=form, current_step='2c')
 
 @study_creation_bp.route('/step3a', methods=['GET', 'POST'])
 @login_required
 def step3a():
     """Step 3a: IPED Task Matrix Generation."""
-    draft = get_study_draft()
+    draft = get_study_draft(include_tasks_matrix=True)
     
     if request.method == 'GET':
         # For GET requests (viewing/navigating), use can_access_step
@@ -590,98 +804,33 @@ def step3a():
             flash('Please complete previous steps first.', 'warning')
             return redirect(url_for('study_creation.step2c'))
     
-    # Get study type to determine functionality
-    study_type = draft.get_step_data('1b').get('study_type', 'grid')
+    steps = draft.get_all_step_data()
     
-    form = Step3aTaskGenerationForm()
+    # Get study type to determine functionality
+    study_type = steps['1b'].get('study_type', 'grid')
     
     # Pre-populate 3a state if stored
-    stored_step3a = draft.get_step_data('3a') or {}
-    if request.method == 'GET' and stored_step3a:
-        if hasattr(form, 'regenerate_matrix'):
-            form.regenerate_matrix.data = stored_step3a.get('regenerate_matrix', False)
+    stored_step3a = steps['3a']
+    form = Step3aTaskGenerationForm(data={'regenerate_matrix': stored_step3a.get('regenerate_matrix', False)})
+    
+    generation_status = get_generation_status(draft)
     
-    if form.validate_on_submit() or not draft.get_step_data('3a'):
+    if form.validate_on_submit() or (not stored_step3a and generation_status is None):
         if study_type == 'grid':
-            # Generate or regenerate task matrix for grid studies
-            try:
-                print(f"DEBUG: Starting task generation for grid study")
-                
-                # Create temporary study object to generate tasks
-                temp_study = Study()
-                step2c_data = draft.get_step_data('2c')
-                
-                print(f"DEBUG: Step 2c data: {step2c_data}")
-                
-                if not step2c_data:
-                    flash('IPED parameters not found. Please complete step 2c first.', 'error')
-                    return render_template('study_creation/step3a.html', 
-                                        form=form, tasks_matrix={}, 
-                                        step2c_data={},
-                                        matrix_summary={},
-                                        current_step='3a', draft=draft,
-                                        study_type=study_type)
-                
-                # Set IPED parameters
-                temp_study.iped_parameters = IPEDParameters(
-                    num_elements=step2c_data['num_elements'],
-                    tasks_per_consumer=step2c_data['tasks_per_consumer'],
-                    number_of_respondents=step2c_data['number_of_respondents'],
-                    min_active_elements=step2c_data['min_active_elements'],
-                    max_active_elements=step2c_data['max_active_elements'],
-                    total_tasks=step2c_data['total_tasks']
-                )
-                
-                print(f"DEBUG: IPED parameters set: {temp_study.iped_parameters}")
-                
-                # Get elements from step2a data
-                step2a_data = draft.get_step_data('2a')
-                print(f"DEBUG: Step 2a data: {step2a_data}")
-                
-                if step2a_data and 'elements' in step2a_data:
-                    temp_study.elements = []
-                    for i, element_data in enumerate(step2a_data['elements']):
-                        print(f"DEBUG: Processing element {i}: {element_data}")
-                        element = StudyElement(
-                            name=element_data.get('name', ''),
-                            description=element_data.get('description', ''),
-                            element_type=element_data.get('element_type', 'image'),
-                            content=element_data.get('content', ''),
-                            alt_text=element_data.get('alt_text', '')
-                        )
-                        print(f"DEBUG: Created element: {element}")
-                        print(f"DEBUG: Element content: {element.content}")
-                        temp_study.elements.append(element)
-                    
-                    print(f"DEBUG: Created {len(temp_study.elements)} elements")
-                    print(f"DEBUG: All elements: {temp_study.elements}")
-                else:
-                    print(f"DEBUG: No step2a data or no elements found")
-                    print(f"DEBUG: step2a_data: {step2a_data}")
-                
-                # Generate task matrix
-                print(f"DEBUG: Calling generate_tasks()")
-                tasks_matrix = temp_study.generate_tasks()
-                print(f"DEBUG: Task matrix generated successfully: {len(tasks_matrix)} respondents")
-                
-                draft.update_step_data('3a', {
-                    'tasks_matrix': tasks_matrix,
-                    'generated_at': datetime.utcnow().isoformat(),
-                    'regenerate_matrix': bool(getattr(form, 'regenerate_matrix', False) and form.regenerate_matrix.data)
-                })
-                draft.current_step = '3b'
-                draft.save()
-                
-                flash('Task matrix generated successfully!', 'success')
-                return redirect(url_for('study_creation.step3b'))
-                
-            except Exception as e:
-                error_msg = f'Error generating task matrix: {str(e)}'
-                print(f"DEBUG: Task generation error: {e}")
-                print(f"DEBUG: Error type: {type(e)}")
-                import traceback
-                print(f"DEBUG: Traceback: {traceback.format_exc()}")
-                flash(error_msg, 'error')
+            if not steps['2c']:
+                flash('IPED parameters not found. Please complete step 2c first.', 'error')
+                return render_template('study_creation/step3a.html', 
+                                    form=form, tasks_matrix={}, 
+                                    step2c_data={},
+                                    matrix_summary={},
+                                    current_step='3a', draft=draft,
+                                    study_type=study_type)
+            
+            # Generate or regenerate the task matrix in the background; the
+            # page polls step3a_status until it has been stored
+            regenerate_matrix = bool(getattr(form, 'regenerate_matrix', False) and form.regenerate_matrix.data)
+            start_task_generation(draft, steps, regenerate_matrix)
+            return redirect(url_for('study_creation.step3a'))
         else:
             # Layer studies not implemented yet
             flash('Task matrix generation for layer studies is not implemented yet.', 'warning')
@@ -692,11 +841,14 @@ def step3a():
                                 current_step='3a', draft=draft,
                                 study_type=study_type)
     
+    if generation_status == 'failed':
+        flash('Error generating task matrix. Please try again.', 'error')
+    
     # Show task matrix preview if available
-    tasks_matrix = stored_step3a.get('tasks_matrix', {}) if stored_step3a else {}
+    tasks_matrix = get_draft_tasks_matrix(draft, steps) or {}
     
     # Get step2c data for pre-population
-    step2c_data = draft.get_step_data('2c') or {}
+    step2c_data = steps['2c']
     
     # Calculate matrix summary statistics
     matrix_summary = {}
@@ -717,18 +869,30 @@ def step3a():
             'elements_per_task': elements_per_task
         }
     
-    return render_template('study_creation/step3a.html', 
+    return render_step('study_creation/step3a.html', draft, 
                          form=form, tasks_matrix=tasks_matrix, 
                          step2c_data=step2c_data,
                          matrix_summary=matrix_summary,
-                         current_step='3a', draft=draft,
+                         generation_pending=(generation_status == 'pending'),
+                         current_step='3a',
                          study_type=study_type)
 
+@study_creation_bp.route('/step3a/status')
+@login_required
+def step3a_status():
+    """Report background task matrix generation progress for the step 3a page."""
+    draft = get_study_draft()
+    return jsonify({
+        'status': get_generation_status(draft) or 'idle',
+        'redirect': url_for('study_creation.step3b')
+    })
+
 @study_creation_bp.route('/step3b', methods=['GET', 'POST'])
 @login_required
 def step3b():
     """Step 3b: Study Preview & Launch."""
-    draft = get_study_draft()
+    # The preview only shows matrix metadata; the matrix itself is needed to launch
+    draft = get_study_draft(include_tasks_matrix=request.method == 'POST')
     
     if request.method == 'GET':
         # For GET requests (viewing/navigating), use can_access_step
@@ -742,9 +906,25 @@ def step3b():
             return redirect(url_for('study_creation.step3a'))
     
     form = Step3bLaunchForm()
+    steps = draft.get_all_step_data()
+    study_type = steps['1b'].get('study_type', 'grid')
+    uploads_pending = settle_image_uploads(draft, steps, study_type)
+    
+    # Prepare study preview data
+    preview_data = {
+        'step1a': steps['1a'],
+        'step1b': steps['1b'],
+        'step1c': steps['1c'],
+        'step1c_layer': steps['1c_layer'],
+        'step2a': steps['2a'],
+        'step2a_layer': steps['2a_layer'],
+        'step2b': steps['2b'],
+        'step2c': steps['2c'],
+        'step3a': steps['3a']
+    }
     
     # Pre-populate from stored step3b data
-    stored_step3b = draft.get_step_data('3b') or {}
+    stored_step3b = steps['3b']
     if request.method == 'GET' and stored_step3b:
         if hasattr(form, 'launch_study'):
             form.launch_study.data = stored_step3b.get('launch_study', False)
@@ -759,28 +939,36 @@ def step3b():
             return render_template('study_creation/step3b.html', 
                                  form=form, study_data=preview_data, current_step='3b', draft=draft)
         
+        # Element images may still be uploading in the background; don't wait
+        # for them here, the page polls until they are done
+        if uploads_pending:
+            flash('Element images are still uploading. You can launch your study as soon as they finish.', 'warning')
+            return redirect(url_for('study_creation.step3b'))
+        if not all(element.get('content') for element in get_step_elements(steps, study_type)):
+            flash('Some element images failed to upload. Please upload them again.', 'error')
+            return redirect(url_for('study_creation.step2a' if study_type == 'grid' else 'study_creation.step2a_layer'))
+        
         # Persist current 3b state in draft
         draft.update_step_data('3b', {
             'launch_study': True
         })
-        draft.save()
         print(f"DEBUG: Draft saved with step3b data")
         try:
             # Create the study
             study = Study(
-                title=draft.get_step_data('1a')['title'],
-                background=draft.get_step_data('1a')['background'],
-                language=draft.get_step_data('1a')['language'],
-                main_question=draft.get_step_data('1b')['main_question'],
-                orientation_text=draft.get_step_data('1b')['orientation_text'],
-                study_type=draft.get_step_data('1b')['study_type'],
+                title=steps['1a']['title'],
+                background=steps['1a']['background'],
+                language=steps['1a']['language'],
+                main_question=steps['1b']['main_question'],
+                orientation_text=steps['1b']['orientation_text'],
+                study_type=steps['1b']['study_type'],
                 creator=current_user,
                 share_token=uuid.uuid4().hex,
                 status='active'
             )
             
             # Set rating scale
-            step1c_data = draft.get_step_data('1c')
+            step1c_data = steps['1c']
             study.rating_scale = RatingScale(
                 min_value=step1c_data['min_value'],
                 max_value=step1c_data['max_value'],
@@ -790,34 +978,27 @@ def step3b():
             )
             
             # Set study elements based on study type
-            study_type = draft.get_step_data('1b').get('study_type', 'grid')
-            
             if study_type == 'grid':
                 # Grid study - traditional elements
-                elements = []
-                step2a_data = draft.get_step_data('2a')
-                if step2a_data and 'elements' in step2a_data:
-                    for i, element_data in enumerate(step2a_data['elements']):
-                        element = StudyElement(
-                            element_id=f"E{i+1}",
-                            name=element_data['name'],
-                            description=element_data.get('description', ''),
-                            element_type=element_data['element_type'],
-                            content=element_data['content'],
-                            alt_text=element_data.get('alt_text', '')
-                        )
-                        elements.append(element)
-                study.elements = elements
-            else:
+                study.elements = [
+                    StudyElement(
+                        element_id=f"E{i+1}",
+                        name=element_data['name'],
+                        description=element_data.get('description', ''),
+                        element_type=element_data['element_type'],
+                        content=element_data['content'],
+                        alt_text=element_data.get('alt_text', '')
+                    )
+                    for i, element_data in enumerate(steps['2a'].get('elements', []))
+                ]
+            elif steps['2a_layer'].get('categories'):
                 # Layer study - categorized elements
-                step2a_layer_data = draft.get_step_data('2a_layer')
-                if step2a_layer_data.get('categories'):
-                    from models.study import LayerCategory
-                    layer_categories = []
-                    for category_data in step2a_layer_data['categories']:
-                        category_elements = []
-                        for j, element_data in enumerate(category_data['elements']):
-                            element = StudyElement(
+                study.layer_categories = [
+                    LayerCategory(
+                        category_id=category_data['category_id'],
+                        category_name=category_data['category_name'],
+                        elements=[
+                            StudyElement(
                                 element_id=f"{category_data['category_id']}{j+1}",
                                 name=element_data['name'],
                                 description=element_data.get('description', ''),
@@ -825,48 +1006,28 @@ def step3b():
                                 content=element_data['content'],
                                 alt_text=element_data.get('alt_text', '')
                             )
-                            category_elements.append(element)
-                        
-                        category = LayerCategory(
-                            category_id=category_data['category_id'],
-                            category_name=category_data['category_name'],
-                            elements=category_elements,
-                            order=category_data['order']
-                        )
-                        layer_categories.append(category)
-                    study.layer_categories = layer_categories
-            
-            # Set classification questions
-            step2b_data = draft.get_step_data('2b')
-            print(f"DEBUG: Step2b data: {step2b_data}")
-            
-            if step2b_data and step2b_data.get('questions'):
-                questions = []
-                for question_data in step2b_data['questions']:
-                    # Clean up any old question_type fields that might exist
-                    if 'question_type' in question_data:
-                        del question_data['question_type']
-                    
-                    # Ensure all required fields are present
-                    if not question_data.get('question_id') or not question_data.get('question_text'):
-                        print(f"DEBUG: Skipping invalid question data: {question_data}")
-                        continue
-                    
-                    question = ClassificationQuestion(
-                        question_id=question_data['question_id'],
-                        question_text=question_data['question_text'],
-                        answer_options=question_data.get('answer_options', []),
-                        is_required=question_data['is_required'],
-                        order=question_data['order']
+                            for j, element_data in enumerate(category_data['elements'])
+                        ],
+                        order=category_data['order']
                     )
-                    questions.append(question)
-                    print(f"DEBUG: Created question: {question.question_id} - {question.question_text}")
-                
-                study.classification_questions = questions
-                print(f"DEBUG: Set {len(questions)} classification questions")
+                    for category_data in steps['2a_layer']['categories']
+                ]
+            
+            # Set classification questions, skipping any without an id or text
+            study.classification_questions = [
+                ClassificationQuestion(
+                    question_id=question_data['question_id'],
+                    question_text=question_data['question_text'],
+                    answer_options=question_data.get('answer_options', []),
+                    is_required=question_data['is_required'],
+                    order=question_data['order']
+                )
+                for question_data in steps['2b'].get('questions', [])
+                if question_data.get('question_id') and question_data.get('question_text')
+            ]
             
             # Set IPED parameters
-            step2c_data = draft.get_step_data('2c')
+            step2c_data = steps['2c']
             study.iped_parameters = IPEDParameters(
                 num_elements=step2c_data['num_elements'],
                 tasks_per_consumer=step2c_data['tasks_per_consumer'],
@@ -877,7 +1038,7 @@ def step3b():
             )
             
             # Set generated tasks
-            step3a_data = draft.get_step_data('3a')
+            step3a_data = steps['3a']
             print(f"DEBUG: Step3a data: {step3a_data}")
             
             if not step3a_data:
@@ -885,12 +1046,13 @@ def step3b():
                 return render_template('study_creation/step3b.html', 
                                      form=form, study_data=preview_data, current_step='3b', draft=draft)
             
-            if 'tasks_matrix' not in step3a_data:
+            tasks_matrix = get_draft_tasks_matrix(draft, steps)
+            if not tasks_matrix:
                 flash('Task matrix not found in step 3a data. Please go back to step 3a and generate the task matrix first.', 'error')
                 return render_template('study_creation/step3b.html', 
                                      form=form, study_data=preview_data, current_step='3b', draft=draft)
             
-            study.tasks = step3a_data['tasks_matrix']
+            study.tasks = tasks_matrix
             print(f"DEBUG: Tasks matrix set successfully")
             
             # Generate share URL
@@ -900,9 +1062,14 @@ def step3b():
             study.save()
             print(f"DEBUG: Study saved with ID: {study._id}")
             
-            # Update user's studies list
-            current_user.studies.append(study)
-            current_user.save()
+            # Copy the tasks into per-task plan documents off the request;
+            # task pages read the matrix directly until they exist
+            background.submit(save_task_plans, study._id)
+            
+            # Update user's studies list with an atomic $push rather than
+            # re-saving the whole user document
+            User.objects(_id=current_user._id).update_one(push__studies=study)
+            invalidate_user(current_user._id)
             print(f"DEBUG: User studies list updated")
             
             # Mark draft as complete and delete it
@@ -921,65 +1088,43 @@ def step3b():
             print(f"DEBUG: Traceback: {traceback.format_exc()}")
             flash(f'Error creating study: {str(e)}', 'error')
     
-    # Debug form validation
     if request.method == 'POST':
-        print(f"DEBUG: POST request received")
-        print(f"DEBUG: Form validation errors: {form.errors}")
-        print(f"DEBUG: Form data: {form.data}")
-        
-        # Debug all step data
-        print(f"DEBUG: All step data available:")
-        print(f"DEBUG: Step1a: {draft.get_step_data('1a')}")
-        print(f"DEBUG: Step1b: {draft.get_step_data('1b')}")
-        print(f"DEBUG: Step1c: {draft.get_step_data('1c')}")
-        print(f"DEBUG: Step2a: {draft.get_step_data('2a')}")
-        print(f"DEBUG: Step2b: {draft.get_step_data('2b')}")
-        print(f"DEBUG: Step2c: {draft.get_step_data('2c')}")
-        print(f"DEBUG: Step3a: {draft.get_step_data('3a')}")
-        print(f"DEBUG: Step3b: {draft.get_step_data('3b')}")
-    
-    # Prepare study preview data
-    preview_data = {
-        'step1a': draft.get_step_data('1a'),
-        'step1b': draft.get_step_data('1b'),
-        'step1c': draft.get_step_data('1c'),
-        'step1c_layer': draft.get_step_data('1c_layer'),
-        'step2a': draft.get_step_data('2a'),
-        'step2a_layer': draft.get_step_data('2a_layer'),
-        'step2b': draft.get_step_data('2b'),
-        'step2c': draft.get_step_data('2c'),
-        'step3a': draft.get_step_data('3a')
-    }
+        current_app.logger.debug('Step 3b form validation errors: %s', form.errors)
     
-    # Debug: Print the data structure
-    print(f"DEBUG: Step3b preview data structure:")
-    print(f"DEBUG: Step2a data: {preview_data['step2a']}")
-    if preview_data['step2a']:
-        print(f"DEBUG: Step2a elements: {preview_data['step2a'].get('elements', [])}")
-        if 'elements' in preview_data['step2a']:
-            for i, elem in enumerate(preview_data['step2a']['elements']):
-                print(f"DEBUG: Element {i}: {elem}")
-    
-    return render_template('study_creation/step3b.html', 
-                         form=form, study_data=preview_data, current_step='3b', draft=draft)
+    return render_step('study_creation/step3b.html', draft, 
+                         form=form, study_data=preview_data, current_step='3b',
+                         uploads_pending=uploads_pending)
+
+@study_creation_bp.route('/step3b/upload-status')
+@login_required
+def step3b_upload_status():
+    """Report background element image uploads for the step 3b page."""
+    draft = get_study_draft()
+    steps = draft.get_all_step_data()
+    study_type = steps['1b'].get('study_type', 'grid')
+    return jsonify({'status': 'pending' if settle_image_uploads(draft, steps, study_type) else 'ready'})
 
 @study_creation_bp.route('/reset')
 @login_required
 def reset():
     """Reset study creation draft."""
-    draft = StudyDraft.objects(user=current_user, is_complete=False).order_by('-created_at').first()
+    draft = StudyDraft.objects(user=current_user, is_complete=False).order_by('-created_at').only('_id').first()
     if draft:
         draft.delete()
     flash('Study creation draft reset. You can start over.', 'info')
     return redirect(url_for('study_creation.step1a'))
 
-@study_creation_bp.route('/debug-draft')
+def _register_debug_routes(state):
+    """Register the draft debug view only in debug mode or when explicitly enabled."""
+    if state.app.debug or state.app.config.get('ENABLE_DEBUG_ROUTES'):
+        state.add_url_rule('/debug-draft', view_func=debug_draft)
+
 @login_required
 def debug_draft():
     """Debug route to check draft data."""
-    draft = get_study_draft()
+    draft = get_study_draft(include_tasks_matrix=True)
     if not draft:
-        return "No draft found"
+        return jsonify({'error': 'No draft found'}), 404
     
     debug_info = {
         'draft_id': str(draft._id),
@@ -994,6 +1139,7 @@ def debug_draft():
         'step2c_data': draft.step2c_data,
         'step3a_data': draft.step3a_data,
         'step3b_data': draft.step3b_data,
+        'completion_mask': draft.get_completion_mask(),
         'step1a_complete': draft.is_step_complete('1a'),
         'step1b_complete': draft.is_step_complete('1b'),
         'step1c_complete': draft.is_step_complete('1c'),
@@ -1006,15 +1152,6 @@ def debug_draft():
         'step3b_complete': draft.is_step_complete('3b'),
     }
     
-    return f"""
-    <h1>Draft Debug Info</h1>
-    <pre>{debug_info}</pre>
-    
-    <h2>Raw Data</h2>
-    <pre>step1c_layer_data: {draft.step1c_layer_data}</pre>
-    <pre>step2a_layer_data: {draft.step2a_layer_data}</pre>
-    
-    <h2>Completion Checks</h2>
-    <pre>1c_layer complete: {draft.is_step_complete('1c_layer')}</pre>
-    <pre>2a_layer complete: {draft.is_step_complete('2a_layer')}</pre>
-    """
+    return jsonify(debug_info)
+
+study_creation_bp.record_once(_register_debug_routes)
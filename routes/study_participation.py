@@ -1,44 +1,150 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from models.study import Study
-from models.response import StudyResponse
-from datetime import datetime, timezone
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
+from werkzeug.exceptions import HTTPException
+from models.study import Study, classification_html_cache_key, get_cached_study, get_cached_study_by_token, get_study_status, invalidate_study, load_respondent_task, save_task_plans
+from models.response import StudyResponse, ClassificationAnswer, CompletedTask
+from datetime import date, datetime, timezone
 import uuid
 import json
+import secrets
+import orjson
+from utils import background
+from utils.cache import cache, get_redis
+from markupsafe import Markup
 
 study_participation = Blueprint('study_participation', __name__)
 
-def safe_datetime_parse(datetime_string):
-    """Parse datetime string and ensure timezone-naive format for MongoDB."""
+@study_participation.errorhandler(Exception)
+def handle_unexpected_error(error):
+    """Answer JSON requests that fail unexpectedly with a generic JSON 500.
+    
+    HTTP errors pass through unchanged and other requests fall back to the
+    app's error pages, so handlers only need to validate their input.
+    """
+    if isinstance(error, HTTPException):
+        return error
+    if not request.is_json:
+        raise error
+    current_app.logger.exception('Unhandled error in %s', request.endpoint)
+    return {'error': 'Internal server error'}, 500
+
+def safe_datetime_parse(datetime_string, default=None):
+    """Parse datetime string and ensure timezone-naive format for MongoDB.
+    
+    Unparseable values return default (the current time if not given).
+    """
     try:
-        dt = datetime.fromisoformat(datetime_string)
-        # Convert to UTC timezone-naive for consistent MongoDB storage
-        if dt.tzinfo is not None:
-            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
-        return dt
-    except Exception as e:
-        print(f"Error parsing datetime {datetime_string}: {e}")
-        return datetime.utcnow()
+        # JavaScript's toISOString() ends in 'Z', which fromisoformat only
+        # accepts from Python 3.11
+        dt = datetime.fromisoformat(datetime_string.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        current_app.logger.warning('Unparseable datetime %r', datetime_string)
+        return default or datetime.utcnow()
+    # Convert to UTC timezone-naive for consistent MongoDB storage
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
 
-@study_participation.route('/study/<study_id>/welcome')
-def welcome(study_id):
-    """Welcome page for study participation"""
+def build_completed_task(task_rating, respondent_id, default_time):
+    """Build a CompletedTask from a task rating stored by task_complete.
+    
+    Timestamps that are missing or unparseable fall back to default_time.
+    """
     try:
-        study = Study.objects.get(_id=study_id)
-        
-        if study.status != 'active':
-            return render_template('study_participation/study_inactive.html', study=study)
-        
-        # Initialize session for this study (but don't create response yet)
-        session['study_id'] = str(study_id)
+        task_duration = float(task_rating.get('task_duration_seconds', 0.0))
+    except (TypeError, ValueError):
+        task_duration = 0.0
+    return CompletedTask(
+        task_id=f"task_{task_rating['task_number']}",
+        respondent_id=respondent_id,
+        task_index=task_rating['task_number'] - 1,
+        elements_shown_in_task=task_rating['task_data'].get('elements_shown', {}),
+        task_start_time=safe_datetime_parse(task_rating.get('task_start_time'), default_time),
+        task_completion_time=safe_datetime_parse(task_rating.get('task_end_time'), default_time),
+        task_duration_seconds=task_duration,
+        rating_given=task_rating['rating'],
+        rating_timestamp=safe_datetime_parse(task_rating['timestamp'], default_time)
+    )
+
+# Rendered classification question lists are the same for every respondent
+CLASSIFICATION_HTML_TIMEOUT = 300
+
+def render_classification_questions(study):
+    """Render a study's classification question list, cached per study.
+    
+    Only the list is shared; the page around it carries the session's CSRF
+    token and is rendered per request.
+    """
+    key = classification_html_cache_key(study._id)
+    html = cache.get(key)
+    if html is None:
+        html = render_template('study_participation/classification_questions.html', study=study)
+        cache.set(key, html, timeout=CLASSIFICATION_HTML_TIMEOUT)
+    return Markup(html)
+
+def _task_ratings_key(response_id):
+    return f'ratings:{response_id}'
+
+def store_task_rating(task_rating):
+    """Record a task rating for the current participant.
+    
+    With Redis configured, ratings are appended to a per-response list so each
+    task doesn't rewrite a session that grows with every rating; otherwise
+    they're kept in the session.
+    """
+    redis_url = current_app.config.get('REDIS_URL')
+    response_id = session.get('response_id')
+    if redis_url and response_id:
+        key = _task_ratings_key(response_id)
+        pipe = get_redis(redis_url).pipeline()
+        pipe.rpush(key, orjson.dumps(task_rating))
+        pipe.expire(key, current_app.config['TRANSIENT_SESSION_LIFETIME'])
+        pipe.execute()
+    else:
+        session['study_data'].setdefault('task_ratings', []).append(task_rating)
+        session.modified = True
+
+def load_task_ratings():
+    """Return the current participant's task ratings in submission order."""
+    task_ratings = list(session.get('study_data', {}).get('task_ratings', []))
+    redis_url = current_app.config.get('REDIS_URL')
+    response_id = session.get('response_id')
+    if redis_url and response_id:
+        stored = get_redis(redis_url).lrange(_task_ratings_key(response_id), 0, -1)
+        task_ratings.extend(orjson.loads(task_rating) for task_rating in stored)
+    return task_ratings
+
+def clear_task_ratings():
+    """Drop the current participant's stored task ratings."""
+    redis_url = current_app.config.get('REDIS_URL')
+    response_id = session.get('response_id')
+    if redis_url and response_id:
+        get_redis(redis_url).delete(_task_ratings_key(response_id))
+
+def render_welcome(study):
+    """Start (or resume) a participant session for study and render its welcome page."""
+    if study.status != 'active':
+        return render_template('study_participation/study_inactive.html', study=study)
+    
+    # Initialize session for this study (but don't create response yet);
+    # revisiting the page keeps the session as it is instead of rewriting it
+    study_id = str(study._id)
+    if session.get('study_id') != study_id or 'study_data' not in session:
+        session['study_id'] = study_id
+        session['session_id'] = secrets.token_hex(16)
         session['current_step'] = 'welcome'
         session['study_data'] = {
             'personal_info': {},
             'classification_answers': [],
             'task_ratings': []
         }
-        
-        return render_template('study_participation/welcome.html', study=study)
-        
+    
+    return render_template('study_participation/welcome.html', study=study)
+
+@study_participation.route('/study/<study_id>/welcome')
+def welcome(study_id):
+    """Welcome page for study participation"""
+    try:
+        return render_welcome(get_cached_study(study_id))
     except Study.DoesNotExist:
         flash('Study not found.', 'error')
         return redirect(url_for('index'))
@@ -48,21 +154,15 @@ def welcome(study_id):
 
 @study_participation.route('/study/<study_id>/participate')
 def participate(study_id):
-    """Direct participation link - redirects to welcome"""
-    return redirect(url_for('study_participation.welcome', study_id=study_id))
+    """Direct participation link - serves the welcome page"""
+    return welcome(study_id)
 
 @study_participation.route('/participate/<share_token>')
 def participate_by_token(share_token):
     """Access study participation by share token"""
     try:
-        study = Study.objects.get(share_token=share_token)
-        
-        if study.status != 'active':
-            return render_template('study_participation/study_inactive.html', study=study)
-        
-        # Redirect to welcome page with study ID
-        return redirect(url_for('study_participation.welcome', study_id=str(study._id)))
-        
+        # Serve the welcome page here rather than redirecting to it
+        return render_welcome(get_cached_study_by_token(share_token))
     except Study.DoesNotExist:
         flash('Study not found.', 'error')
         return redirect(url_for('index'))
@@ -74,7 +174,7 @@ def participate_by_token(share_token):
 def personal_info(study_id):
     """Personal information collection page"""
     try:
-        study = Study.objects.get(_id=study_id)
+        study = get_cached_study(study_id)
         
         if study.status != 'active':
             return redirect(url_for('study_participation.welcome', study_id=study_id))
@@ -91,8 +191,12 @@ def personal_info(study_id):
             
             # Calculate age from birth date
             try:
-                birth_date_obj = datetime.strptime(birth_date, '%Y-%m-%d')
-                age = (datetime.utcnow() - birth_date_obj).days // 365
+                # fromisoformat is a fast C parser (strptime re-parses the format
+                # on every call); count whole years, minus one if the birthday
+                # hasn't come round yet this year
+                born = date.fromisoformat(birth_date)
+                today = datetime.utcnow().date()
+                age = today.year - born.year - ((today.month, today.day) < (born.month, born.day))
                 if age < 13 or age > 120:
                     flash('Please enter a valid age between 13 and 120.', 'error')
                     return render_template('study_participation/personal_info.html', study=study)
@@ -109,6 +213,8 @@ def personal_info(study_id):
                 'gender': gender
             }
             session['study_data']['personal_info'] = personal_info_data
+            # A new response starts here; drop ratings from an earlier attempt
+            session['study_data']['task_ratings'] = []
             session['current_step'] = 'personal_info'
             
             # Mark session as modified (CRITICAL for Flask sessions)
@@ -118,21 +224,28 @@ def personal_info(study_id):
             print(f"Current session data: {session.get('study_data')}")
             
             # Create StudyResponse object now that user has actually started
+            respondent_id = None
             try:
-                # Calculate respondent ID based on total responses
-                respondent_id = study.total_responses
+                # Claim the next respondent ID atomically; modify() returns
+                # the counter's value from before the increment
+                respondent_id = Study.objects(_id=study._id).only('total_responses').modify(
+                    inc__total_responses=1
+                ).total_responses
                 
                 # Get total tasks from IPED parameters
                 total_tasks = 0
                 if hasattr(study, 'iped_parameters') and study.iped_parameters:
                     total_tasks = study.iped_parameters.tasks_per_consumer
-                    print(f"IPED tasks per consumer: {total_tasks}")
                 else:
-                    print("Warning: No IPED parameters found, using default")
+                    current_app.logger.warning('Study %s has no IPED parameters, using default task count', study._id)
                     total_tasks = 25  # Default fallback
                 
                 # Create new response object
-                session_id = str(uuid.uuid4())
+                # Reuse the participant's id from the welcome page, unless an
+                # earlier response already claimed it (session_id is unique)
+                session_id = session.get('session_id')
+                if not session_id or 'response_id' in session:
+                    session_id = secrets.token_hex(16)
                 response = StudyResponse(
                     _id=str(uuid.uuid4()),
                     study=study,
@@ -149,10 +262,6 @@ def personal_info(study_id):
                 )
                 response.save()
                 
-                # Update study total_responses
-                study.total_responses += 1
-                study.save()
-                
                 # Store in session
                 session['response_id'] = str(response._id)
                 session['session_id'] = session_id
@@ -161,11 +270,15 @@ def personal_info(study_id):
                 # Mark session as modified (CRITICAL for Flask sessions)
                 session.modified = True
                 
-                print(f"Created new response: {response._id} with respondent_id: {respondent_id}")
-                print(f"Study total_responses updated to: {study.total_responses}")
+                current_app.logger.debug('Created response %s with respondent_id %s', response._id, respondent_id)
                 
-            except Exception as e:
-                print(f"Error creating response: {str(e)}")
+            except Exception:
+                current_app.logger.exception('Error creating response for study %s', study._id)
+                if respondent_id is not None:
+                    # Give the ID back, unless a later participant has already claimed the next one
+                    Study.objects(_id=study._id, total_responses=respondent_id + 1).update_one(
+                        inc__total_responses=-1
+                    )
                 flash('Error creating study response. Please try again.', 'error')
                 return render_template('study_participation/personal_info.html', study=study)
             
@@ -187,7 +300,7 @@ def personal_info(study_id):
 def classification(study_id):
     """Classification questions page"""
     try:
-        study = Study.objects.get(_id=study_id)
+        study = get_cached_study(study_id)
         
         if study.status != 'active':
             return redirect(url_for('study_participation.welcome', study_id=study_id))
@@ -197,18 +310,21 @@ def classification(study_id):
             return redirect(url_for('study_participation.personal_info', study_id=study_id))
         
         if request.method == 'POST':
-            # Get classification answers
-            answers = []
-            for question in study.classification_questions:
-                answer = request.form.get(f'classification_{question.question_id}')
-                if answer:
-                    answers.append({
-                        'question_id': question.question_id,
-                        'question_text': question.question_text,
-                        'answer': answer,
-                        'answer_timestamp': datetime.utcnow().isoformat(),
-                        'time_spent_seconds': 0.0  # Will be calculated from frontend
-                    })
+            # Get classification answers; all answers share one submission timestamp
+            answered_at = datetime.utcnow()
+            answer_timestamp = answered_at.isoformat()
+            form = request.form
+            answers = [
+                {
+                    'question_id': question.question_id,
+                    'question_text': question.question_text,
+                    'answer': answer,
+                    'answer_timestamp': answer_timestamp,
+                    'time_spent_seconds': 0.0  # Will be calculated from frontend
+                }
+                for question in study.classification_questions
+                if (answer := form.get(f'classification_{question.question_id}'))
+            ]
             
             # Store in session
             if 'study_data' not in session:
@@ -225,35 +341,38 @@ def classification(study_id):
             # Update StudyResponse object if it exists
             if 'response_id' in session:
                 try:
-                    response = StudyResponse.objects.get(_id=session['response_id'])
                     # Convert to ClassificationAnswer objects
-                    from models.response import ClassificationAnswer
-                    classification_answers = []
-                    for answer_data in answers:
-                        classification_answer = ClassificationAnswer(
+                    classification_answers = [
+                        ClassificationAnswer(
                             question_id=answer_data['question_id'],
                             question_text=answer_data['question_text'],
                             answer=answer_data['answer'],
-                            answer_timestamp=safe_datetime_parse(answer_data['answer_timestamp']),
+                            answer_timestamp=answered_at,
                             time_spent_seconds=answer_data['time_spent_seconds']
                         )
-                        classification_answers.append(classification_answer)
+                        for answer_data in answers
+                    ]
                     
-                    response.classification_answers = classification_answers
-                    response.last_activity = datetime.utcnow()
-                    response.save()
-                    print(f"Updated classification answers for response: {response._id}")
-                except StudyResponse.DoesNotExist:
-                    print(f"Response not found: {session['response_id']}")
-                except Exception as e:
-                    print(f"Error updating response: {str(e)}")
+                    # Replace the answers in one atomic update rather than loading
+                    # and re-saving the whole response
+                    updated = StudyResponse.objects(_id=session['response_id']).update_one(
+                        set__classification_answers=classification_answers,
+                        set__last_activity=answered_at
+                    )
+                    if updated:
+                        current_app.logger.debug('Updated classification answers for response %s', session['response_id'])
+                    else:
+                        current_app.logger.warning('Response %s not found for classification answers', session['response_id'])
+                except Exception:
+                    current_app.logger.exception('Error updating response %s', session['response_id'])
             else:
                 print("No response_id in session")
             
             # Redirect to first task
             return redirect(url_for('study_participation.task', study_id=study_id, task_number=1))
         
-        return render_template('study_participation/classification.html', study=study)
+        return render_template('study_participation/classification.html', study=study,
+                               questions_html=render_classification_questions(study))
         
     except Study.DoesNotExist:
         flash('Study not found.', 'error')
@@ -266,7 +385,7 @@ def classification(study_id):
 def task(study_id, task_number):
     """Task interface page"""
     try:
-        study = Study.objects.get(_id=study_id)
+        study = get_cached_study(study_id)
         
         if study.status != 'active':
             return redirect(url_for('study_participation.welcome', study_id=study_id))
@@ -277,34 +396,9 @@ def task(study_id, task_number):
         if not session.get('study_data', {}).get('classification_answers'):
             return redirect(url_for('study_participation.classification', study_id=study_id))
         
-        # Ensure study_data structure is complete
-        if 'study_data' not in session:
-            session['study_data'] = {}
-        if 'task_ratings' not in session['study_data']:
-            session['study_data']['task_ratings'] = []
-        
         print(f"Task route - Session data: {session.get('study_data')}")
         print(f"Task route - Response ID: {session.get('response_id')}")
         
-        # Get tasks from study - check if tasks exist
-        if not hasattr(study, 'tasks') or not study.tasks:
-            # Try to generate tasks if they don't exist
-            try:
-                if hasattr(study, 'generate_tasks'):
-                    study.generate_tasks()
-                    study.save()
-                else:
-                    flash('Study tasks not configured properly.', 'error')
-                    return redirect(url_for('study_participation.welcome', study_id=study_id))
-            except Exception as e:
-                flash(f'Error generating tasks: {str(e)}', 'error')
-                return redirect(url_for('study_participation.welcome', study_id=study_id))
-        
-        # Check if tasks were generated
-        if not hasattr(study, 'tasks') or not study.tasks:
-            flash('Study tasks could not be generated.', 'error')
-            return redirect(url_for('study_participation.welcome', study_id=study_id))
-        
         # Get total tasks from IPED parameters
         total_tasks = study.iped_parameters.tasks_per_consumer 
         
@@ -313,13 +407,27 @@ def task(study_id, task_number):
             return redirect(url_for('study_participation.welcome', study_id=study_id))
         
         # Get the specific task data - tasks are organized by respondent_id
-        # For anonymous participation, we'll use respondent_id 0
-        respondent_tasks = study.tasks.get("0", [])
-        if not respondent_tasks or task_number > len(respondent_tasks):
-            flash('Task data not found.', 'error')
-            return redirect(url_for('study_participation.welcome', study_id=study_id))
-        
-        current_task = respondent_tasks[task_number - 1]
+        # For anonymous participation, we'll use respondent_id 0. The cached
+        # study has no task matrix, so just this one task is fetched.
+        current_task = load_respondent_task(study._id, 0, task_number - 1)
+        if current_task is None:
+            # Try to generate tasks if the study has none yet
+            try:
+                full_study = Study.objects.get(_id=study_id)
+                if not full_study.tasks:
+                    full_study.generate_tasks()
+                    full_study.save()
+                    invalidate_study(study._id)
+                    background.submit(save_task_plans, study._id)
+                respondent_tasks = full_study.tasks.get("0", [])
+            except Exception as e:
+                flash(f'Error generating tasks: {str(e)}', 'error')
+                return redirect(url_for('study_participation.welcome', study_id=study_id))
+            
+            if task_number > len(respondent_tasks):
+                flash('Task data not found.', 'error')
+                return redirect(url_for('study_participation.welcome', study_id=study_id))
+            current_task = respondent_tasks[task_number - 1]
         
         # For GET requests, just render the task page
         # For POST requests (if any), handle them the same way
@@ -339,108 +447,72 @@ def task(study_id, task_number):
 @study_participation.route('/study/<study_id>/task-complete', methods=['POST'])
 def task_complete(study_id):
     """Handle task completion data from sessionStorage"""
-    print(f"=== TASK COMPLETE ROUTE CALLED ===")
-    print(f"Study ID: {study_id}")
-    print(f"Request method: {request.method}")
-    print(f"Request URL: {request.url}")
-    print(f"Request headers: {dict(request.headers)}")
-    print(f"Session data: {session}")
-    
     try:
-        study = Study.objects.get(_id=study_id)
-        print(f"Study found: {study.title}")
-        
-        if study.status != 'active':
-            print(f"Study not active: {study.status}")
-            return {'error': 'Study not active'}, 400
-        
-        # Get task data from request
-        data = request.get_json()
-        
-        print(f"Request JSON data: {data}")
-        
-        if not data:
-            print("No JSON data provided")
-            return {'error': 'No data provided'}, 400
-        
-        # Validate required fields
-        required_fields = ['task_number', 'rating', 'timestamp', 'task_start_time', 'task_end_time', 'task_duration_seconds']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            print(f"Missing required fields: {missing_fields}")
-            return {'error': f'Missing required fields: {missing_fields}'}, 400
-        
-        # Ensure session structure is valid
-        if 'study_data' not in session:
-            print("No study_data in session")
-            return {'error': 'Invalid session state'}, 400
-        
-        if 'task_ratings' not in session['study_data']:
-            session['study_data']['task_ratings'] = []
-            print("Initialized task_ratings in session")
-        
-        # Store task data in session
-        if 'study_data' not in session:
-            session['study_data'] = {}
-        if 'task_ratings' not in session['study_data']:
-            session['study_data']['task_ratings'] = []
-        
-        # Create new task rating data
-        new_task_rating = {
-            'task_number': data.get('task_number'),
-            'rating': data.get('rating'),
-            'timestamp': data.get('timestamp'),
-            'task_start_time': data.get('task_start_time'),
-            'task_end_time': data.get('task_end_time'),
-            'task_duration_seconds': data.get('task_duration_seconds'),
-            'task_data': data.get('task_data', {})
-        }
-        
-        # Append to existing ratings
-        session['study_data']['task_ratings'].append(new_task_rating)
-        
-        # Mark session as modified (CRITICAL for Flask sessions)
-        session.modified = True
-        
-        print(f"Task {data.get('task_number')} completed with duration: {data.get('task_duration_seconds')} seconds")
-        print(f"Updated session task_ratings: {session['study_data']['task_ratings']}")
-        
-        # Update StudyResponse object if it exists
-        if 'response_id' in session:
-            try:
-                response = StudyResponse.objects.get(_id=session['response_id'])
-                response.last_activity = datetime.utcnow()
-                response.save()
-                print(f"Updated task completion for response: {response._id}")
-            except StudyResponse.DoesNotExist:
-                print(f"Response not found: {session['response_id']}")
-            except Exception as e:
-                print(f"Error updating response: {str(e)}")
-        else:
-            print("No response_id in session")
-        
-        return {'success': True, 'message': 'Task data stored'}
-        
+        status = get_study_status(study_id)
     except Study.DoesNotExist:
-        print(f"Study not found with ID: {study_id}")
         return {'error': 'Study not found'}, 404
-    except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {'error': str(e)}, 500
+    
+    if status != 'active':
+        return {'error': 'Study not active'}, 400
+    
+    # Get task data from request (decoded by the app's orjson provider);
+    # malformed JSON is treated as missing rather than raising
+    data = request.get_json(silent=True)
+    if not data:
+        return {'error': 'No data provided'}, 400
+    
+    # Validate required fields
+    required_fields = ['task_number', 'rating', 'timestamp', 'task_start_time', 'task_end_time', 'task_duration_seconds']
+    missing_fields = [field for field in required_fields if field not in data]
+    if missing_fields:
+        return {'error': f'Missing required fields: {missing_fields}'}, 400
+    task_number = data['task_number']
+    if not isinstance(task_number, int) or isinstance(task_number, bool) or task_number < 1 or not isinstance(data.get('task_data', {}), dict):
+        return {'error': 'Invalid task data'}, 400
+    
+    # Ensure session structure is valid
+    if 'study_data' not in session:
+        return {'error': 'Invalid session state'}, 400
+    
+    store_task_rating({
+        'task_number': task_number,
+        'rating': data.get('rating'),
+        'timestamp': data.get('timestamp'),
+        'task_start_time': data.get('task_start_time'),
+        'task_end_time': data.get('task_end_time'),
+        'task_duration_seconds': data.get('task_duration_seconds'),
+        'task_data': data.get('task_data', {})
+    })
+    
+    # Update StudyResponse object if it exists
+    if 'response_id' in session:
+        try:
+            # Write progress and activity time directly instead of loading the response
+            # first; this runs once per task, so go straight to the collection
+            # task_number is 1-based, so it is also the index of the next task
+            progress = {'last_activity': datetime.utcnow(), 'current_task_index': task_number}
+            result = StudyResponse._get_collection().update_one(
+                {'_id': session['response_id']}, {'$set': progress}
+            )
+            if not result.matched_count:
+                current_app.logger.warning('Response %s not found for task completion', session['response_id'])
+        except Exception:
+            current_app.logger.exception('Error updating response %s', session['response_id'])
+    
+    return {'success': True, 'message': 'Task data stored'}
 
 @study_participation.route('/study/<study_id>/completed')
 def completed(study_id):
     """Study completion page"""
     try:
-        study = Study.objects.get(_id=study_id)
+        study = get_cached_study(study_id)
         
         # Check if all data is available
         study_data = session.get('study_data', {})
+        task_ratings = load_task_ratings()
         if not (study_data.get('personal_info') and 
                 study_data.get('classification_answers') and 
-                study_data.get('task_ratings')):
+                task_ratings):
             print(f"Missing required data in session: {study_data}")
             print(f"Session keys: {list(session.keys())}")
             return redirect(url_for('study_participation.welcome', study_id=study_id))
@@ -453,82 +525,50 @@ def completed(study_id):
                 print(f"Session data keys: {list(session.keys())}")
                 print(f"Study data keys: {list(study_data.keys())}")
                 
-                response = StudyResponse.objects.get(_id=session['response_id'])
-                print(f"Found response: {response._id}")
+                # Only the timing and task count are needed; the study is already
+                # loaded from the cache
+                responses = StudyResponse._get_collection()
+                response = responses.find_one(
+                    {'_id': session['response_id']},
+                    {'session_start_time': 1, 'total_tasks_assigned': 1}
+                )
+                if response is None:
+                    flash('No response found. Please start the study again.', 'error')
+                    return redirect(url_for('study_participation.welcome', study_id=study_id))
                 
                 # Calculate session timing
                 completion_time = datetime.utcnow()
                 
-                # Use the session_start_time from the response object (set when response was created)
-                start_time = response.session_start_time
-                total_time = (completion_time - start_time).total_seconds()
+                # Use the session_start_time from the response (set when it was created)
+                total_time = (completion_time - response['session_start_time']).total_seconds()
                 
-                print(f"Session start time: {start_time}")
-                print(f"Session end time: {completion_time}")
                 print(f"Total session duration: {total_time} seconds")
                 
-                # Update response with completion data
-                response.session_end_time = completion_time
-                response.is_completed = True
-                response.total_study_duration = total_time
-                response.last_activity = completion_time
-                response.completed_tasks_count = len(study_data['task_ratings'])
-                
-                print(f"Updated response fields - Tasks count: {response.completed_tasks_count}")
-                
-                # Add completed tasks with proper timing data from JavaScript
-                print(f"\n--- ADDING COMPLETED TASKS ---")
-                for i, task_rating in enumerate(study_data['task_ratings']):
-                    print(f"Processing task {i+1}/{len(study_data['task_ratings'])}: {task_rating['task_number']}")
-                    
-                    # Get task timing from JavaScript
-                    task_start_time = None
-                    task_completion_time = None
-                    task_duration = 0.0
-                    
-                    # Use the actual task timestamps from JavaScript
-                    try:
-                        if 'task_start_time' in task_rating:
-                            task_start_time = safe_datetime_parse(task_rating['task_start_time'])
-                        if 'task_end_time' in task_rating:
-                            task_completion_time = safe_datetime_parse(task_rating['task_end_time'])
-                        if 'task_duration_seconds' in task_rating:
-                            task_duration = float(task_rating['task_duration_seconds'])
-                            
-                        print(f"  Task {task_rating['task_number']}: Start={task_start_time}, End={task_completion_time}, Duration={task_duration}s")
-                    except Exception as e:
-                        print(f"  Error parsing task timestamps: {e}")
-                        # Fallback values
-                        task_start_time = completion_time
-                        task_completion_time = completion_time
-                        task_duration = 0.0
-                    
-                    task_data = {
-                        'task_id': f"task_{task_rating['task_number']}",
-                        'respondent_id': session['respondent_id'],
-                        'task_index': task_rating['task_number'] - 1,
-                        'elements_shown_in_task': task_rating['task_data'].get('elements_shown', {}),
-                        'task_start_time': task_start_time,
-                        'task_completion_time': task_completion_time,
-                        'task_duration_seconds': task_duration,
-                        'rating_given': task_rating['rating'],
-                        'rating_timestamp': safe_datetime_parse(task_rating['timestamp'])
-                    }
-                    
-                    print(f"  Adding task data: {task_data}")
-                    response.add_completed_task(task_data)
-                    print(f"  Task added successfully")
-                
-                print(f"\n--- SAVING RESPONSE ---")
-                response.update_completion_percentage()
-                print(f"Completion percentage: {response.completion_percentage}")
-                
-                response.save()
-                print(f"Response saved successfully!")
+                # Every value is built here, so write the completion straight to the
+                # collection instead of loading the document and revalidating all of
+                # it (every completed task included) in save(). The ratings come from
+                # the client, so each task is still validated before it is written.
+                completed_tasks = []
+                for task_rating in task_ratings:
+                    completed_task = build_completed_task(task_rating, session['respondent_id'], completion_time)
+                    completed_task.validate()
+                    completed_tasks.append(completed_task.to_mongo())
+                total_tasks = response.get('total_tasks_assigned') or 0
+                completion = {
+                    'session_end_time': completion_time,
+                    'is_completed': True,
+                    'total_study_duration': total_time,
+                    'last_activity': completion_time,
+                    'completed_tasks': completed_tasks,
+                    'completed_tasks_count': len(completed_tasks),
+                    'completion_percentage': StudyResponse.compute_completion_percentage(len(completed_tasks), total_tasks)
+                }
+                responses.update_one({'_id': response['_id']}, {'$set': completion})
                 
-                print(f"Completed response: {response._id}")
+                current_app.logger.debug('Completed response %s (%d tasks)', response['_id'], len(completed_tasks))
                 
                 # Clear session data
+                clear_task_ratings()
                 session.pop('study_data', None)
                 session.pop('study_id', None)
                 session.pop('current_step', None)
@@ -538,7 +578,8 @@ def completed(study_id):
                 
                 print(f"Session cleared successfully")
                 
-                return render_template('study_participation/completed.html', study=study, response=response)
+                return render_template('study_participation/completed.html', study=study,
+                                       response=dict(completion, _id=response['_id']))
             else:
                 print("No response_id in session")
                 flash('No response found. Please start the study again.', 'error')
@@ -565,7 +606,7 @@ def completed(study_id):
 def study_inactive(study_id):
     """Study inactive page"""
     try:
-        study = Study.objects.get(_id=study_id)
+        study = get_cached_study(study_id)
         return render_template('study_participation/study_inactive.html', study=study)
     except Study.DoesNotExist:
         flash('Study not found.', 'error')
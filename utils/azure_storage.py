@@ -3,8 +3,10 @@ import os
 from azure.storage.blob import BlobServiceClient
 from flask import current_app
 
-def upload_to_azure(file):
-    """Upload file to Azure Blob Storage and return URL"""
+_DEFAULT_ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'webp'})
+
+def upload_to_azure(file, filename=None):
+    """Upload file (a FileStorage or file-like object) to Azure Blob Storage and return URL"""
     try:
         # Get configuration from Flask app
         connection_string = current_app.config.get('AZURE_STORAGE_CONNECTION_STRING')
@@ -18,7 +20,8 @@ def upload_to_azure(file):
         blob_service_client = BlobServiceClient.from_connection_string(connection_string)
         
         # Generate unique blob name
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else ''
+        filename = filename or getattr(file, 'filename', None)
+        file_extension = os.path.splitext(filename)[1] if filename else ''
         blob_name = f"{uuid.uuid4()}{file_extension}"
         
         # Get blob client
@@ -27,8 +30,8 @@ def upload_to_azure(file):
         # Reset file pointer to beginning
         file.seek(0)
         
-        # Upload file
-        blob_client.upload_blob(file.read(), overwrite=True)
+        # Upload file; large blobs are sent as parallel chunks
+        blob_client.upload_blob(file, overwrite=True, max_concurrency=8)
         
         # Return the public URL
         account_name = connection_string.split(';')[1].split('=')[1]
@@ -72,8 +75,14 @@ def delete_from_azure(blob_url):
 
 def is_valid_image_file(filename):
     """Check if the file is a valid image file"""
-    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif', 'webp'})
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+    allowed_extensions = current_app.config.get('_ALLOWED_EXT_SET', _DEFAULT_ALLOWED_EXTENSIONS)
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in allowed_extensions
+
+def has_image_signature(header):
+    """Check the leading bytes of a file for a PNG, JPEG, GIF or WebP signature"""
+    return (header.startswith((b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a'))
+            or (header[:4] == b'RIFF' and header[8:12] == b'WEBP'))
 
 def get_file_size_mb(file):
     """Get file size in MB"""
@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from flask import current_app
+
+# Shared per-process pool for work that shouldn't hold a gunicorn worker
+# (e.g. task matrix generation). Jobs live in memory, so callers record their
+# own progress in the database and treat jobs that never finish as failed.
+_executor = None
+_executor_lock = Lock()
+
+def _get_executor(max_workers):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='background')
+    return _executor
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in a background thread inside the current app's context."""
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                app.logger.exception('Background job %s failed', fn.__name__)
+
+    return _get_executor(app.config['BACKGROUND_WORKERS']).submit(run)
@@ -0,0 +1,16 @@
+import redis
+from flask_caching import Cache
+
+# Shared Flask-Caching instance, bound in create_app. Backed by Redis when
+# REDIS_URL is configured, otherwise a per-process SimpleCache.
+cache = Cache()
+
+_redis_clients = {}
+
+def get_redis(url):
+    """Return a shared Redis client (and connection pool) for the given URL."""
+    client = _redis_clients.get(url)
+    if client is None:
+        client = redis.Redis.from_url(url)
+        _redis_clients[url] = client
+    return client
@@ -0,0 +1,44 @@
+from flask_session.sessions import RedisSessionInterface
+from itsdangerous import want_bytes
+
+class TransientRedisSessionInterface(RedisSessionInterface):
+    """Redis session interface that evicts non-permanent sessions early.
+
+    Flask-Session keeps every session in Redis for PERMANENT_SESSION_LIFETIME.
+    Sessions that aren't marked permanent (anonymous study participants; logins
+    set session.permanent) expire after TRANSIENT_SESSION_LIFETIME instead, so
+    abandoned participant sessions don't linger for a month.
+    """
+
+    def save_session(self, app, session, response):
+        # Flask-Session 0.5 rewrites the session on every request; skip that
+        # when it's unchanged and SESSION_REFRESH_EACH_REQUEST is off
+        if not session or session.permanent:
+            if not session or self.should_set_cookie(app, session):
+                super().save_session(app, session, response)
+            return
+
+        key = self.key_prefix + session.sid
+        lifetime = app.config['TRANSIENT_SESSION_LIFETIME']
+        if not self.should_set_cookie(app, session):
+            # Sliding expiry: active participants keep their session
+            self.redis.expire(key, lifetime)
+            return
+
+        # RedisSessionInterface.save_session, but written with the transient
+        # lifetime so a changed session costs a single SETEX
+        self.redis.setex(name=key, value=self.serializer.dumps(dict(session)), time=lifetime)
+        if self.use_signer:
+            session_id = self._get_signer(app).sign(want_bytes(session.sid))
+        else:
+            session_id = session.sid
+        cookie_kwargs = {}
+        if self.has_same_site_capability:
+            cookie_kwargs['samesite'] = self.get_cookie_samesite(app)
+        response.set_cookie(app.config['SESSION_COOKIE_NAME'], session_id,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=self.get_cookie_domain(app),
+                            path=self.get_cookie_path(app),
+                            secure=self.get_cookie_secure(app),
+                            **cookie_kwargs)